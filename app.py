@@ -1,43 +1,234 @@
-from flask import Flask, render_template, request, abort, make_response, send_from_directory, make_response, Response
+from flask import Flask, Blueprint, current_app, render_template, request, abort, make_response, send_from_directory, make_response, Response, g, has_request_context, get_template_attribute, jsonify, stream_with_context, stream_template, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_caching import Cache
 from flask_compress import Compress
-from sqlalchemy import func, desc
-from datetime import datetime
+from sqlalchemy import func, desc, or_, and_, event, select, table, column, literal
+from sqlalchemy.dialects.mysql import match as mysql_match
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timezone
+import functools
+import hashlib
 import time
 import logging
 import json
 import os
+import re
 from dotenv import load_dotenv
+import click
 
+import unicodedata
 import urllib.parse
+from werkzeug.security import safe_join
+from markupsafe import Markup
+from assets import StaticAssets
+import blobs
+from fragments import FragmentCache
+import metrics
+import database
 # Import your existing models
-# Assuming models are in a file named models.py, otherwise paste them here.
-from database import Base, CommunityPost, PostContentBlock, PostAttachment
-
-app = Flask(__name__)
+from models import Base, CommunityPost, PostContentBlock, PostAttachment, ChannelSummary, AppState, PostSearch, DATA_GENERATION, SEARCH_FTS_TABLE
 
 load_dotenv()
-# --- Configuration ---
-# Update URI to your actual database
-app.config['SQLALCHEMY_DATABASE_URI']  = os.getenv('DATABASE_URL') 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_pre_ping': True,
-    'pool_recycle': 280,  # Recycle connections before the DB timeout (usually 300s)
-}
-
-# Cache Config (Simple in-memory cache for demonstration)
-# For production, use 'redis' or 'memcached'
-app.config['CACHE_TYPE'] = 'SimpleCache' 
-app.config['CACHE_DEFAULT_TIMEOUT'] = 1800  # 30 minutes server-side default
-
-# Init extensions
-db = SQLAlchemy(app, model_class=Base)
-cache = Cache(app)
-
-app.config['COMPRESS_MIN_SIZE'] = 5000
-Compress(app)
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Extensions and routes are bound to an app by create_app
+db = SQLAlchemy(model_class=Base)
+cache = Cache()
+compress = Compress()
+bp = Blueprint('archive', __name__)
+
+# Fingerprinted static assets, hashed and precompressed once per process
+# (once in total when gunicorn preloads the app before forking workers)
+static_assets = StaticAssets(os.path.join(ROOT_PATH, 'static'), ['style.css', 'script.js'])
+
+def create_app(config=None):
+    """
+    Application factory, `flask --app app` and gunicorn `app:create_app()` both find it.
+    Opens no database connection: the pool fills on the first query in the process serving it,
+    so the app can be created before gunicorn forks (--preload, see gunicorn.conf.py).
+    config overrides the settings below, e.g. export.py's STATIC_EXPORT.
+    """
+    app = Flask(__name__)
+
+    # --- Configuration ---
+    # Update URI to your actual database
+    app.config['SQLALCHEMY_DATABASE_URI']  = os.getenv('DATABASE_URL') 
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_pre_ping': True,
+        'pool_recycle': 280,  # Recycle connections before the DB timeout (usually 300s)
+    }
+
+    # Cache Config
+    # SimpleCache is per worker process. To share one cache between gunicorn workers use
+    # CACHE_TYPE=FileSystemCache (single host, CACHE_DIR) or CACHE_TYPE=RedisCache (CACHE_REDIS_URL, needs the redis package).
+    # Cache keys include the data generation bumped by generate.py, so entries can live long.
+    app.config['CACHE_TYPE'] = os.getenv('CACHE_TYPE', 'SimpleCache')
+    app.config['CACHE_DEFAULT_TIMEOUT'] = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 86400))  # 1 day server-side default
+    app.config['CACHE_DIR'] = os.getenv('CACHE_DIR', '/tmp/community_tab_display_cache')
+    app.config['CACHE_THRESHOLD'] = int(os.getenv('CACHE_THRESHOLD', 10000))
+    app.config['CACHE_REDIS_URL'] = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    # Seconds each worker trusts its copy of the data generation before re-reading it
+    app.config['DATA_GENERATION_TTL'] = float(os.getenv('DATA_GENERATION_TTL', 5))
+
+    app.config['COMPRESS_MIN_SIZE'] = 5000
+
+    # Offload /files transfers to the front proxy: '' (send directly), 'x-accel' (nginx) or 'x-sendfile'
+    app.config['FILES_OFFLOAD'] = os.getenv('FILES_OFFLOAD', '').lower()
+    # nginx internal location that maps to the files directory, e.g.
+    #   location /protected-files/ { internal; alias /app/files/; }
+    app.config['FILES_ACCEL_PREFIX'] = os.getenv('FILES_ACCEL_PREFIX', '/protected-files/')
+    app.config['USE_X_SENDFILE'] = app.config['FILES_OFFLOAD'] == 'x-sendfile'
+    # Content-addressed attachment store written by generate.py --dedupe-attachments into post_root,
+    # found the same way as /files, and the nginx internal location that maps to it
+    app.config['BLOB_DIR'] = os.path.join(app.root_path, 'files', blobs.STORE_DIR)
+    app.config['BLOB_ACCEL_PREFIX'] = app.config['FILES_ACCEL_PREFIX'].rstrip('/') + '/' + blobs.STORE_DIR + '/'
+
+    # Set by export.py: pagination links use page numbers, which map to static files
+    app.config['STATIC_EXPORT'] = False
+
+    # Per-request SQL query budget, 0 disables the check.
+    # Exceeding it raises in debug/testing (to catch lazy-load N+1 regressions) and logs a warning otherwise.
+    app.config['SQL_QUERY_LIMIT'] = int(os.getenv('SQL_QUERY_LIMIT', 0))
+
+    app.config.update(config or {})
+
+    # Init extensions
+    db.init_app(app)
+    cache.init_app(app)
+    compress.init_app(app)
+
+    # Prometheus metrics on /metrics (needs prometheus_client), set METRICS_DISABLED=1 to hide the route
+    metrics.init_app(app)
+    metrics.instrument_cache(app, cache)
+
+    app.register_blueprint(bp)
+    app.cli.command('init-db')(init_db_command)
+    return app
+
+def after_fork(app):
+    """
+    Called in each gunicorn worker when the app was created in the master (--preload):
+    drops pooled connections copied from the master without closing them under it.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+def init_db_command():
+    """Create missing tables and indexes (uses DATABASE_ADMIN_URL when set)."""
+    database.init_db()
+    click.echo("Database schema is up to date")
+
+@bp.app_context_processor
+def inject_asset_url():
+    return {'asset_url': static_assets.url}
+
+# --- SQL query counting ---
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_queries = g.get('sql_queries', 0) + 1
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started and has_request_context():
+        g.sql_seconds = g.get('sql_seconds', 0.0) + time.perf_counter() - started.pop()
+
+@bp.after_app_request
+def check_query_count(response):
+    queries = g.get('sql_queries', 0)
+    if current_app.debug or current_app.testing:
+        response.headers['X-SQL-Queries'] = str(queries)
+    limit = current_app.config['SQL_QUERY_LIMIT']
+    if limit and queries > limit:
+        message = f"{request.path} ran {queries} SQL queries (limit {limit})"
+        if current_app.debug or current_app.testing:
+            raise AssertionError(message)
+        logging.warning(message)
+    return response
+
+def with_post_content(query):
+    """
+    Bulk-loads content blocks, attachments and image variants for every post the query returns,
+    three extra queries in total instead of three per post when templates touch them.
+    """
+    return query.options(
+        selectinload(CommunityPost.content_blocks),
+        selectinload(CommunityPost.attachments),
+        selectinload(CommunityPost.variants)
+    )
+
+# Rendered post fragments, keyed by post_id plus the channel's last ingest time.
+# FRAGMENT_CACHE_SHARED=1 also stores them in the page cache backend for other workers.
+post_fragments = FragmentCache(
+    max_bytes=int(os.getenv('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024)),
+    shared=cache if os.getenv('FRAGMENT_CACHE_SHARED', '0') == '1' else None
+)
+
+def render_post_fragments(posts, template='post_macro.html', macro='render_post', key_prefix='post', **macro_args):
+    """
+    Returns the rendered macro output for each post, in order, from the fragment cache where possible.
+    Only posts missing from the cache get their blocks and attachments loaded (in bulk) and rendered.
+    Fragments are keyed by post_id and the channel's channel_summary.updated_at, which changes
+    whenever the ingest path writes to that channel.
+    """
+    if not posts:
+        return []
+    channel_versions = dict(db.session.query(ChannelSummary.channel_id, ChannelSummary.updated_at)
+                            .filter(ChannelSummary.channel_id.in_({post.channel_id for post in posts})).all())
+
+    if current_app.config['STATIC_EXPORT']:
+        # Exported fragments link attachments by path, the blob store isn't exported
+        key_prefix = f"{key_prefix}/export"
+
+    def fragment_key(post):
+        updated_at = channel_versions.get(post.channel_id)
+        return f"{key_prefix}/{TEMPLATES_VERSION}/{post.post_id}/{updated_at.isoformat() if updated_at else ''}"
+
+    keys = [fragment_key(post) for post in posts]
+    fragments = post_fragments.get_many(keys)
+
+    missing = [post for post, key in zip(posts, keys) if key not in fragments]
+    metrics.record_cache('fragment', len(posts) - len(missing), len(missing))
+    if missing:
+        with_post_content(db.session.query(CommunityPost))\
+            .filter(CommunityPost.post_id.in_([post.post_id for post in missing])).all()
+        started = time.perf_counter()
+        render = get_template_attribute(template, macro)
+        rendered = {fragment_key(post): str(render(post, **macro_args)) for post in missing}
+        metrics.record_render(f"{template}:{macro}", time.perf_counter() - started)
+        post_fragments.set_many(rendered)
+        fragments.update(rendered)
+
+    return [Markup(fragments[key]) for key in keys]
+
+# --- Data generation for cache keys ---
+data_generation = {"value": 0, "checked": None}
+
+def get_data_generation():
+    """
+    Returns the data generation bumped by generate.py after each ingest.
+    Re-read from the database at most every DATA_GENERATION_TTL seconds per worker.
+    """
+    now = time.monotonic()
+    checked = data_generation["checked"]
+    if checked is None or now - checked >= current_app.config['DATA_GENERATION_TTL']:
+        data_generation["value"] = db.session.query(AppState.value)\
+            .filter(AppState.name == DATA_GENERATION).scalar() or 0
+        data_generation["checked"] = now
+    return data_generation["value"]
+
+def versioned_cache_key(*args, **kwargs):
+    """
+    Cache key for a view: data generation, path and the sorted query string.
+    """
+    query = urllib.parse.urlencode(sorted(request.args.items(multi=True)))
+    return f"view/{get_data_generation()}/{request.path}?{query}"
 
 # --- Helper to add Cache-Control headers ---
 def add_cache_headers(response, max_age=3600):
@@ -45,91 +236,335 @@ def add_cache_headers(response, max_age=3600):
     return response
 
 
+# --- Conditional GET (ETag / Last-Modified) ---
+def get_templates_version():
+    """
+    Newest mtime of the templates and static files, so a deploy changes every ETag.
+    """
+    mtimes = [0]
+    for folder in ('templates', 'static'):
+        for root, dirs, files in os.walk(os.path.join(ROOT_PATH, folder)):
+            mtimes.extend(os.path.getmtime(os.path.join(root, name)) for name in files)
+    return int(max(mtimes))
+
+TEMPLATES_VERSION = get_templates_version()
+
+def conditional(get_version):
+    """
+    Adds ETag and Last-Modified to a view and answers If-None-Match / If-Modified-Since
+    with a 304 before the view (or its cache) runs.
+    get_version(**view_args) returns (version, last_modified) from a single cheap query,
+    or None when there is nothing to validate against (the view then decides, e.g. 404).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            version = get_version(**kwargs)
+            if version is None:
+                return view(**kwargs)
+            key, last_modified = version
+
+            # Only the resource's own version, an ingest that didn't touch it keeps its validators
+            etag = hashlib.sha1(
+                f"{TEMPLATES_VERSION}/{request.path}/{key}".encode()
+            ).hexdigest()
+            # Stored timestamps are naive local times, HTTP dates are whole seconds
+            last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+
+            if not_modified:
+                response = add_cache_headers(Response(status=304))
+            else:
+                response = make_response(view(**kwargs))
+            # Weak, since Flask-Compress may serve a different encoding of the same content
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+def latest_update_version():
+    """
+    Version for pages covering every channel: the last time any channel was ingested.
+    """
+    updated_at = db.session.query(func.max(ChannelSummary.updated_at)).scalar()
+    return (updated_at.isoformat(), updated_at) if updated_at else None
+
+def channel_version(channel_id, page=None):
+    updated_at = db.session.query(ChannelSummary.updated_at)\
+        .filter(ChannelSummary.channel_id == channel_id).scalar()
+    return (f"{channel_id}/{updated_at.isoformat()}", updated_at) if updated_at else None
+
+def post_version(post_id):
+    row = db.session.query(CommunityPost.timestamp, ChannelSummary.updated_at)\
+        .join(ChannelSummary, ChannelSummary.channel_id == CommunityPost.channel_id)\
+        .filter(CommunityPost.post_id == post_id).first()
+    return (f"{post_id}/{row.updated_at.isoformat()}", max(row.timestamp, row.updated_at)) if row else None
+
+
 # --- Routes ---
 
-@app.route('/')
-@cache.cached(timeout=1800) # Server-side cache: 30 mins
+@bp.route('/')
+@conditional(latest_update_version)
+@cache.cached(make_cache_key=versioned_cache_key)
 def index():
     """
     Home Page: Lists authors with their latest post details.
-    Optimized to fetch latest profile pic and timestamp per channel.
-    """
-    # Subquery 1: Get the latest timestamp for each channel
-    latest_posts_sub = db.session.query(
-        CommunityPost.channel_id,
-        func.max(CommunityPost.timestamp).label('max_ts')
-    ).group_by(CommunityPost.channel_id).subquery()
-
-    # Subquery 2: Count total posts per channel
-    count_sub = db.session.query(
-        CommunityPost.channel_id,
-        func.count(CommunityPost.post_id).label('post_count')
-    ).group_by(CommunityPost.channel_id).subquery()
-
-    # Main Query: Join CommunityPost with the subqueries to get full details of the latest post
-    # We join on channel_id AND timestamp to get the specific row that is the "latest"
-    authors = db.session.query(
-        func.distinct(CommunityPost.channel_id).label('channel_id'),
-        CommunityPost.channel_name,
-        CommunityPost.profile_pic_url,
-        CommunityPost.timestamp,
-        count_sub.c.post_count
-    ).join(
-        latest_posts_sub, 
-        (CommunityPost.channel_id == latest_posts_sub.c.channel_id) & 
-        (CommunityPost.timestamp == latest_posts_sub.c.max_ts)
-    ).join(
-        count_sub,
-        CommunityPost.channel_id == count_sub.c.channel_id
-    ).order_by(desc(CommunityPost.timestamp)).all()
+    Reads the channel_summary table maintained by generate.py.
+    """
+    authors = db.session.query(ChannelSummary)\
+        .order_by(desc(ChannelSummary.latest_timestamp)).all()
 
     response = make_response(render_template('index.html', authors=authors))
     return add_cache_headers(response)
 
 
-@app.route('/channel/<channel_id>')
-@cache.cached(timeout=1800, query_string=True) # Cache based on URL params too
-def channel_page(channel_id):
+# --- Keyset pagination for channel pages ---
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+def encode_cursor(post):
+    """
+    Opaque page cursor for a post: its timestamp and post_id, the channel page sort key.
+    """
+    return f"{post.timestamp.strftime(CURSOR_TIME_FORMAT)}_{post.post_id}"
+
+def decode_cursor(cursor):
+    """
+    Returns (timestamp, post_id) for a cursor made by encode_cursor, aborts with 400 if it is malformed.
+    """
+    try:
+        ts, post_id = cursor.split('_', 1)
+        return datetime.strptime(ts, CURSOR_TIME_FORMAT), post_id
+    except ValueError:
+        abort(400)
+
+
+class PostPage:
+    """
+    A page of posts plus the cursors for the neighbouring pages.
+    page is only known when the page was requested by number.
+    """
+    def __init__(self, items, has_prev, has_next, page=None):
+        self.items = items
+        self.has_prev = has_prev and bool(items)
+        self.has_next = has_next and bool(items)
+        self.page = page
+        self.prev_cursor = encode_cursor(items[0]) if self.has_prev else None
+        self.next_cursor = encode_cursor(items[-1]) if self.has_next else None
+
+
+def paginate_posts(query, limit, page=None, before=None, after=None):
+    """
+    Pages a CommunityPost query newest first on (timestamp, post_id).
+    before/after are cursors from PostPage; page falls back to an OFFSET for old ?page= links.
+    Fetches limit + 1 rows to tell whether another page exists, so no COUNT query is needed.
+    """
+    newest_first = (desc(CommunityPost.timestamp), desc(CommunityPost.post_id))
+
+    if after:
+        ts, post_id = decode_cursor(after)
+        rows = query.filter(or_(
+            CommunityPost.timestamp > ts,
+            and_(CommunityPost.timestamp == ts, CommunityPost.post_id > post_id)
+        )).order_by(CommunityPost.timestamp, CommunityPost.post_id).limit(limit + 1).all()
+        has_prev = len(rows) > limit
+        return PostPage(list(reversed(rows[:limit])), has_prev=has_prev, has_next=True)
+
+    if before:
+        ts, post_id = decode_cursor(before)
+        rows = query.filter(or_(
+            CommunityPost.timestamp < ts,
+            and_(CommunityPost.timestamp == ts, CommunityPost.post_id < post_id)
+        )).order_by(*newest_first).limit(limit + 1).all()
+        return PostPage(rows[:limit], has_prev=True, has_next=len(rows) > limit)
+
+    page = page or 1
+    rows = query.order_by(*newest_first).offset((page - 1) * limit).limit(limit + 1).all()
+    return PostPage(rows[:limit], has_prev=page > 1, has_next=len(rows) > limit, page=page)
+
+
+@bp.route('/channel/<channel_id>')
+@bp.route('/channel/<channel_id>/page/<int:page>')
+@conditional(channel_version)
+@cache.cached(make_cache_key=versioned_cache_key) # Cache based on URL params too
+def channel_page(channel_id, page=None):
     """
     Channel Page: Paginated posts for a specific author.
+    Pages are addressed by ?before=/?after= cursors; ?page= and /page/<n> still work,
+    and are what the static export links to.
     """
     # Pagination Logic
-    page = request.args.get('page', 1, type=int)
+    if page is None:
+        page = request.args.get('page', None, type=int)
+    before = request.args.get('before')
+    after = request.args.get('after')
     limit = request.args.get('limit', 20, type=int)
     
     # Enforce Hard Limit
     if limit > 30: limit = 30
     if limit < 1: limit = 1
+    if page is not None and page < 1: abort(404)
 
     # Query
     query = db.session.query(CommunityPost)\
-        .filter(CommunityPost.channel_id == channel_id)\
-        .order_by(desc(CommunityPost.timestamp))
-    
-    # Use SQLAlchemy pagination
-    # error_out=False returns empty list instead of 404 on out of range, 
-    # but we handle empty items manually below.
-    pagination = query.paginate(page=page, per_page=limit, error_out=False)
+        .filter(CommunityPost.channel_id == channel_id)
 
-    if not pagination.items and page != 1:
-        # If page > 1 and no items, it's a 404
-        abort(404)
-    elif not pagination.items and page == 1:
-        # If page 1 has no items, the channel probably doesn't exist
+    pagination = paginate_posts(query, limit, page=page, before=before, after=after)
+
+    if not pagination.items:
+        # An empty page is a 404, on page 1 the channel probably doesn't exist
         abort(404)
 
-    response = make_response(render_template(
+    response = make_response(render_channel_page(channel_id, pagination))
+    return add_cache_headers(response)
+
+def render_channel_page(channel_id, pagination):
+    """
+    HTML of a channel page for a PostPage, shared with the static export.
+    """
+    return render_template(
         'channel_posts.html', 
-        posts=pagination.items, 
+        fragments=render_post_fragments(pagination.items), 
         pagination=pagination, 
         channel_id=channel_id,
         channel_name=pagination.items[0].channel_name if pagination.items else "Unknown"
-    ))
-    return add_cache_headers(response)
+    )
+
+
+# --- Full-text search ---
+# Longest query accepted, longer ones are cut
+SEARCH_MAX_QUERY = 200
+
+def fts5_query(q):
+    """
+    FTS5 MATCH expression for user input: every word quoted, so operators and
+    punctuation are searched for literally and all words must match.
+    """
+    return " ".join('"{0}"'.format(word.replace('"', '""')) for word in q.split())
 
+def search_scores(q, channel_id=None):
+    """
+    Select of (post_id, score) for posts matching q, a higher score is a better match.
+    Uses the FULLTEXT index on MariaDB/MySQL and the FTS5 table on SQLite;
+    other databases fall back to a LIKE scan with every score 0.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        fts = table(SEARCH_FTS_TABLE, column('rowid'), column('rank'), column(SEARCH_FTS_TABLE))
+        # rank is bm25(), lower is better
+        stmt = select(PostSearch.post_id, (-fts.c.rank).label('score'))\
+            .join(fts, fts.c.rowid == PostSearch.id)\
+            .where(fts.c[SEARCH_FTS_TABLE].op('MATCH')(fts5_query(q)))
+    elif dialect in ('mysql', 'mariadb'):
+        score = mysql_match(PostSearch.body, against=q).in_natural_language_mode()
+        stmt = select(PostSearch.post_id, score.label('score')).where(score)
+    else:
+        stmt = select(PostSearch.post_id, literal(0.0).label('score'))\
+            .where(and_(*[PostSearch.body.ilike(f"%{word}%") for word in q.split()]))
+    if channel_id:
+        stmt = stmt.where(PostSearch.channel_id == channel_id)
+    return stmt
+
+def encode_search_cursor(score, post_id):
+    return f"{score!r}_{post_id}"
+
+def decode_search_cursor(cursor):
+    """
+    Returns (score, post_id) for a cursor made by encode_search_cursor, aborts with 400 if it is malformed.
+    """
+    try:
+        score, post_id = cursor.split('_', 1)
+        return float(score), post_id
+    except ValueError:
+        abort(400)
 
-@app.route('/post/<post_id>')
-@cache.cached(timeout=1800)
+def search_posts(q, channel_id=None, limit=20, after=None):
+    """
+    Ranked search, best match first with post_id breaking ties.
+    Returns ([(post_id, score)], next_cursor), next_cursor is None on the last page.
+    """
+    q = q.strip()[:SEARCH_MAX_QUERY]
+    if not q.split():
+        return [], None
+    scores = search_scores(q, channel_id).subquery()
+    stmt = select(scores.c.post_id, scores.c.score)
+    if after:
+        score, post_id = decode_search_cursor(after)
+        stmt = stmt.where(or_(
+            scores.c.score < score,
+            and_(scores.c.score == score, scores.c.post_id > post_id)
+        ))
+    rows = db.session.execute(
+        stmt.order_by(desc(scores.c.score), scores.c.post_id).limit(limit + 1)
+    ).all()
+    next_cursor = encode_search_cursor(rows[limit - 1].score, rows[limit - 1].post_id) if len(rows) > limit else None
+    return [tuple(row) for row in rows[:limit]], next_cursor
+
+def get_search_args():
+    """
+    (q, channel_id, limit, cursor) from the query string of a search request.
+    """
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return (request.args.get('q', ''), request.args.get('channel_id') or None,
+            limit, request.args.get('cursor'))
+
+@bp.route('/search')
+@cache.cached(make_cache_key=versioned_cache_key)
+def search():
+    """
+    Search page: ranked posts matching ?q=, optionally within ?channel_id=, paged by ?cursor=.
+    """
+    q, channel_id, limit, cursor = get_search_args()
+    results, next_cursor = search_posts(q, channel_id, min(limit, 30), cursor)
+
+    posts = {post.post_id: post for post in db.session.query(CommunityPost)
+             .filter(CommunityPost.post_id.in_([post_id for post_id, _ in results]))}
+    ordered = [posts[post_id] for post_id, _ in results if post_id in posts]
+
+    response = make_response(render_template(
+        'search.html',
+        q=q,
+        channel_id=channel_id,
+        fragments=render_post_fragments(ordered),
+        next_cursor=next_cursor
+    ))
+    return add_cache_headers(response, max_age=300)
+
+@bp.route('/api/search')
+@cache.cached(make_cache_key=versioned_cache_key)
+def api_search():
+    """
+    JSON search: {"results": [...], "next_cursor": ...}, same parameters as /search.
+    """
+    q, channel_id, limit, cursor = get_search_args()
+    results, next_cursor = search_posts(q, channel_id, limit, cursor)
+
+    rows = {post.post_id: (post, body) for post, body in db.session.query(CommunityPost, PostSearch.body)
+            .join(PostSearch, PostSearch.post_id == CommunityPost.post_id)
+            .filter(CommunityPost.post_id.in_([post_id for post_id, _ in results]))}
+    items = []
+    for post_id, score in results:
+        if post_id not in rows:
+            continue
+        post, body = rows[post_id]
+        items.append({
+            "post_id": post.post_id,
+            "channel_id": post.channel_id,
+            "channel_name": post.channel_name,
+            "timestamp": post.timestamp.isoformat(),
+            "score": score,
+            "text": body,
+        })
+    return add_cache_headers(jsonify(results=items, next_cursor=next_cursor), max_age=300)
+
+
+@bp.route('/post/<post_id>')
+@conditional(post_version)
+@cache.cached(make_cache_key=versioned_cache_key)
 def single_post(post_id):
     """
     Single Post Page: Loads a specific post.
@@ -139,75 +574,346 @@ def single_post(post_id):
     if not post:
         abort(404)
 
-    response = make_response(render_template('single_post.html', post=post))
+    response = make_response(render_template('single_post.html', post=post, fragment=render_post_fragments([post])[0]))
     return add_cache_headers(response)
 
-@app.route('/style.css')
+
+# --- JSON API ---
+# Posts per query in /api/export
+EXPORT_BATCH_SIZE = 500
+
+def post_to_dict(post):
+    """
+    JSON form of a post with its content blocks and attachments (load them with with_post_content).
+    """
+    return {
+        "post_id": post.post_id,
+        "channel_id": post.channel_id,
+        "channel_name": post.channel_name,
+        "profile_pic_url": post.profile_pic_url,
+        "timestamp": post.timestamp.isoformat(),
+        "likes_count": post.likes_count,
+        "is_members_only": bool(post.is_members_only),
+        "content": [{"text": block.text_content, "url": block.link_url} for block in post.content_blocks],
+        "attachments": [{"type": attach.file_type, "url": blob_url(attach) or "/" + quote_url(attach.file_path.lstrip('/'))}
+                        for attach in post.attachments],
+    }
+
+@bp.route('/api/channels')
+@conditional(latest_update_version)
+@cache.cached(make_cache_key=versioned_cache_key)
+def api_channels():
+    """
+    Every channel with its post count and latest post, from channel_summary.
+    """
+    channels = db.session.query(ChannelSummary)\
+        .order_by(desc(ChannelSummary.latest_timestamp)).all()
+    return add_cache_headers(jsonify(channels=[{
+        "channel_id": channel.channel_id,
+        "channel_name": channel.channel_name,
+        "profile_pic_url": channel.profile_pic_url,
+        "post_count": channel.post_count,
+        "latest_timestamp": channel.latest_timestamp.isoformat() if channel.latest_timestamp else None,
+    } for channel in channels]))
+
+@bp.route('/api/channel/<channel_id>')
+@conditional(channel_version)
+@cache.cached(make_cache_key=versioned_cache_key)
+def api_channel_posts(channel_id):
+    """
+    A page of a channel's posts, newest first, with the same ?before=/?after=/?limit= cursors as the channel page.
+    """
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    query = with_post_content(db.session.query(CommunityPost))\
+        .filter(CommunityPost.channel_id == channel_id)
+    pagination = paginate_posts(query, limit, before=request.args.get('before'), after=request.args.get('after'))
+    if not pagination.items:
+        abort(404)
+    return add_cache_headers(jsonify(
+        channel_id=channel_id,
+        posts=[post_to_dict(post) for post in pagination.items],
+        prev_cursor=pagination.prev_cursor,
+        next_cursor=pagination.next_cursor
+    ))
+
+@bp.route('/api/post/<post_id>')
+@conditional(post_version)
+@cache.cached(make_cache_key=versioned_cache_key)
+def api_post(post_id):
+    post = with_post_content(db.session.query(CommunityPost))\
+        .filter(CommunityPost.post_id == post_id).first()
+    if not post:
+        abort(404)
+    return add_cache_headers(jsonify(post_to_dict(post)))
+
+@bp.route('/api/export')
+def api_export():
+    """
+    Streams posts as NDJSON, one post per line, oldest first.
+    Optional ?channel_id= and ?since= (ISO date/time, inclusive) filters.
+    Posts are read in keyset batches of EXPORT_BATCH_SIZE, each with its content in bulk,
+    and dropped from the session once written, so memory does not grow with the export.
+    """
+    channel_id = request.args.get('channel_id')
+    since = request.args.get('since')
+    if since:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            abort(400)
+
+    query = db.session.query(CommunityPost)
+    if channel_id:
+        query = query.filter(CommunityPost.channel_id == channel_id)
+    if since:
+        query = query.filter(CommunityPost.timestamp >= since)
+
+    def generate():
+        last = None
+        while True:
+            batch = with_post_content(query)
+            if last:
+                batch = batch.filter(or_(
+                    CommunityPost.timestamp > last.timestamp,
+                    and_(CommunityPost.timestamp == last.timestamp, CommunityPost.post_id > last.post_id)
+                ))
+            posts = batch.order_by(CommunityPost.timestamp, CommunityPost.post_id).limit(EXPORT_BATCH_SIZE).all()
+            if not posts:
+                break
+            yield "".join(json.dumps(post_to_dict(post), ensure_ascii=False) + "\n" for post in posts)
+            last = posts[-1]
+            db.session.expunge_all()
+            if len(posts) < EXPORT_BATCH_SIZE:
+                break
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@bp.route('/assets/<filename>')
+def serve_asset(filename):
+    """
+    Serves fingerprinted assets. The URL changes with the content, so they can be cached forever,
+    and the precompressed variant matching Accept-Encoding is sent as is.
+    """
+    asset = static_assets.get(filename)
+    if asset is None:
+        abort(404)
+
+    encoding, data = asset.choose(request.accept_encodings)
+    response = Response(data, mimetype=asset.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(f"{asset.digest}-{encoding or 'identity'}")
+    return response.make_conditional(request)
+
+@bp.route('/style.css')
 def serve_css():
     return add_cache_headers(make_response(send_from_directory('static', 'style.css')), max_age=3600)
 
-@app.route('/script.js')
+@bp.route('/script.js')
 def serve_js():
     return add_cache_headers(make_response(send_from_directory('static', 'script.js')), max_age=3600)
 
-@app.route('/favicon.ico')
+@bp.route('/favicon.ico')
 def favicon():
     try:
         return add_cache_headers(make_response(send_from_directory('static', 'favicon.ico')), max_age=3600)
     except FileNotFoundError:
         abort(404)
 
-@app.route('/files/<path:filename>')
+def attachment_disposition(response, name):
+    """
+    Sets Content-Disposition: attachment with an ASCII filename and an RFC 5987 one when needed.
+    """
+    try:
+        name.encode('ascii')
+        options = {'filename': name}
+    except UnicodeEncodeError:
+        options = {
+            'filename': unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii'),
+            'filename*': f"UTF-8''{urllib.parse.quote(name, safe='!#$&+^`|~')}"
+        }
+    response.headers.set('Content-Disposition', 'attachment', **options)
+
+@bp.route('/files/<path:filename>')
 def serve_file(filename):
     """
     Serves files under /files directory.
     - Preserves subdirectory structure.
     - If ?download=true, serves as an attachment.
+    - FILES_OFFLOAD=x-accel hands the transfer to nginx via X-Accel-Redirect under FILES_ACCEL_PREFIX,
+      FILES_OFFLOAD=x-sendfile sets X-Sendfile for Apache/lighttpd. Otherwise the file is sent
+      directly with ETag, conditional and Range (206) support.
     """
     download = request.args.get('download', 'false').lower() == 'true'
+    files_dir = os.path.join(current_app.root_path, 'files')
 
-    try:
-        response = make_response(send_from_directory('files', filename, as_attachment=download))
+    path = safe_join(files_dir, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    if current_app.config['FILES_OFFLOAD'] == 'x-accel':
+        # Flask only resolves and authorizes, nginx sends the bytes (with its own Range/ETag handling)
+        response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = current_app.config['FILES_ACCEL_PREFIX'].rstrip('/') + '/' + \
+            urllib.parse.quote(filename.replace('\\', '/'))
+        if download:
+            attachment_disposition(response, os.path.basename(path))
         return add_cache_headers(response, max_age=3600)
-    except FileNotFoundError:
+
+    # USE_X_SENDFILE makes send_file emit X-Sendfile instead of the body
+    response = send_from_directory(files_dir, filename, as_attachment=download, conditional=True, etag=True, max_age=3600)
+    return add_cache_headers(response, max_age=3600)
+
+
+# Blobs never change, a year is the longest max-age caches honour
+BLOB_MAX_AGE = 31536000
+
+@bp.route('/blob/<name>')
+def serve_blob(name):
+    """
+    Serves an attachment from the content-addressed store by its sha256 (plus extension, for the type).
+    The URL can only ever mean these bytes, so it is cached as immutable and never revalidated.
+    ?download=<filename> serves it as an attachment under that name.
+    """
+    match = blobs.BLOB_NAME.match(name)
+    if not match:
+        abort(404)
+    content_hash = match.group(1)
+    relative = f"{content_hash[:2]}/{content_hash}"
+    path = blobs.blob_path(current_app.config['BLOB_DIR'], content_hash)
+    if not os.path.isfile(path):
         abort(404)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    download = os.path.basename(request.args.get('download', '').replace('\\', '/'))
+
+    if current_app.config['FILES_OFFLOAD'] == 'x-accel':
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = current_app.config['BLOB_ACCEL_PREFIX'].rstrip('/') + '/' + relative
+    else:
+        response = send_from_directory(current_app.config['BLOB_DIR'], relative, mimetype=mimetype,
+                                       conditional=True, etag=content_hash, max_age=BLOB_MAX_AGE)
+    if download:
+        attachment_disposition(response, download)
+    response.headers['Cache-Control'] = f'public, max-age={BLOB_MAX_AGE}, immutable'
+    return response
 
 
 from email import utils
 import mimetypes
 
-@app.template_filter('get_mime_type')
+@bp.app_template_filter('get_mime_type')
 def get_mime_type(path: str) -> str:
     mime_type, _ = mimetypes.guess_file_type(path)
     return mime_type or "application/octet-stream"
 
-@app.route('/rss/rss.xml')
-@cache.cached(timeout=1800)
-def rss_feed():
-    posts = (
-        db.session.query(CommunityPost)
-        .order_by(desc(CommunityPost.timestamp))
-        .limit(100)
-        .all()
-    )
+# Items per feed, and posts loaded per query while streaming one
+RSS_FEED_ITEMS = 100
+RSS_BATCH_SIZE = 25
 
-    last_build_date = (
-        utils.format_datetime(posts[0].timestamp)
-        if posts else
-        utils.format_datetime(datetime.now())
-    )
+def parse_bool_arg(name):
+    """
+    Optional boolean query argument: None when absent, aborts with 400 if it isn't a boolean.
+    """
+    value = request.args.get(name, '').lower()
+    if not value:
+        return None
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    abort(400)
+
+def feed_items(query, limit):
+    """
+    Yields the rendered <item>s for the newest limit posts of query, loading them
+    RSS_BATCH_SIZE at a time on (timestamp, post_id) so only one batch is held at once.
+    """
+    last = None
+    while limit > 0:
+        batch = query
+        if last:
+            batch = batch.filter(or_(
+                CommunityPost.timestamp < last.timestamp,
+                and_(CommunityPost.timestamp == last.timestamp, CommunityPost.post_id < last.post_id)
+            ))
+        size = min(RSS_BATCH_SIZE, limit)
+        posts = batch.order_by(desc(CommunityPost.timestamp), desc(CommunityPost.post_id)).limit(size).all()
+        yield from render_post_fragments(
+            posts,
+            template='rss_item.xml',
+            macro='render_rss_item',
+            # Items contain absolute URLs
+            key_prefix=f"rss/{request.host_url}",
+            format_date=utils.format_datetime
+        )
+        if len(posts) < size:
+            break
+        limit -= size
+        last = posts[-1]
+        db.session.expunge_all()
+
+def stream_feed(query, version, **template_args):
+    """
+    Streams the RSS document for query's newest posts.
+    The finished body is cached under the feed's URL and version (e.g. its channel's
+    updated_at), so a feed is only rendered again when its own posts change.
+    """
+    cache_key = f"feed/{TEMPLATES_VERSION}/{request.host_url}{request.full_path}/{version}"
+    body = cache.get(cache_key)
+    if body is not None:
+        return add_cache_headers(Response(body, mimetype="application/rss+xml"))
+
+    latest = query.with_entities(CommunityPost.timestamp)\
+        .order_by(desc(CommunityPost.timestamp)).limit(1).scalar()
+    last_build_date = utils.format_datetime(latest or datetime.now())
+
+    def generate():
+        chunks = []
+        for chunk in stream_template('rss.xml', items=feed_items(query, RSS_FEED_ITEMS),
+                                     last_build_date=last_build_date, **template_args):
+            chunks.append(chunk)
+            yield chunk
+        cache.set(cache_key, "".join(chunks))
+
+    return add_cache_headers(Response(stream_with_context(generate()), mimetype="application/rss+xml"))
+
+@bp.route('/rss/rss.xml')
+@conditional(latest_update_version)
+def rss_feed():
+    """
+    Latest posts of every channel.
+    """
+    version = latest_update_version()
+    return stream_feed(db.session.query(CommunityPost), version[0] if version else '')
 
-    xml_body = render_template(
-        'rss.xml',
-        posts=posts,
-        last_build_date=last_build_date,
-        format_date=utils.format_datetime,
-        get_mime_type=get_mime_type
+@bp.route('/rss/<channel_id>.xml')
+@conditional(channel_version)
+def channel_rss_feed(channel_id):
+    """
+    Latest posts of one channel, ?members_only=1 or 0 to only include or exclude members-only posts.
+    Served from the channel_timestamp index.
+    """
+    version = channel_version(channel_id)
+    if version is None:
+        abort(404)
+    members_only = parse_bool_arg('members_only')
+
+    query = db.session.query(CommunityPost).filter(CommunityPost.channel_id == channel_id)
+    if members_only is not None:
+        query = query.filter(CommunityPost.is_members_only == members_only)
+
+    channel_name = db.session.query(ChannelSummary.channel_name)\
+        .filter(ChannelSummary.channel_id == channel_id).scalar()
+    return stream_feed(
+        query, version[0],
+        title=f"{channel_name} - YouTube Community Posts",
+        link=url_for('archive.channel_page', channel_id=channel_id, _external=True),
+        description=f"RSS Feed for {channel_name}"
     )
 
-    return add_cache_headers(Response(xml_body, mimetype="application/rss+xml"))
-
-@app.template_filter('quote_url')
+@bp.app_template_filter('quote_url')
 def quote_url(url):
     if not url:
         return ""
@@ -219,5 +925,38 @@ def quote_url(url):
     # Encode special characters but keep / safe
     return urllib.parse.quote(url, safe='/')
 
+@bp.app_template_filter('profile_pic_size')
+def profile_pic_size(url, size=100):
+    """
+    Profile pictures are stored at full size (=s0), ask for one fit for a thumbnail instead.
+    """
+    if not url:
+        return ""
+    return re.sub(r'=s0$', f'=s{size}', url)
+
+@bp.app_template_filter('blob_url')
+def blob_url(attachment, download=False, external=False):
+    """
+    /blob/ URL of an attachment that is in the content-addressed store, '' otherwise
+    (and in static exports, which don't copy the store).
+    """
+    if not attachment.content_hash or current_app.config['STATIC_EXPORT']:
+        return ''
+    args = {'download': os.path.basename(attachment.file_path)} if download else {}
+    return url_for('archive.serve_blob', name=blobs.blob_name(attachment.content_hash, attachment.file_path),
+                   _external=external, **args)
+
+@bp.app_template_filter('image_variants')
+def image_variants(attachment, variants):
+    """
+    Groups the post's variants of one attachment by format, smallest first: {format: [variant, ...]}.
+    """
+    grouped = {}
+    for variant in sorted(variants, key=lambda v: v.width):
+        # variant_path == file_path is the marker for images without copies
+        if variant.file_path == attachment.file_path and variant.variant_path != attachment.file_path:
+            grouped.setdefault(variant.format, []).append(variant)
+    return grouped
+
 if __name__ == '__main__':
-    app.run(debug=True, port=os.getenv("FLASK_RUN_PORT", 5000))
\ No newline at end of file
+    create_app().run(debug=True, port=os.getenv("FLASK_RUN_PORT", 5000))
\ No newline at end of file
@@ -0,0 +1,62 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StaticAsset:
+    """
+    A static file loaded into memory with its content-hashed name and
+    precompressed gzip/brotli variants.
+    """
+    def __init__(self, folder, name):
+        with open(os.path.join(folder, name), 'rb') as f:
+            self.data = f.read()
+        self.name = name
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.digest = hashlib.sha256(self.data).hexdigest()[:16]
+        stem, ext = os.path.splitext(name)
+        self.fingerprinted_name = f"{stem}.{self.digest}{ext}"
+        self.encodings = {'gzip': gzip.compress(self.data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(self.data)
+
+    def choose(self, accept_encodings):
+        """
+        Returns (encoding, data) for the smallest variant the client accepts, encoding None for the original.
+        accept_encodings is a werkzeug MIMEAccept-style object (request.accept_encodings).
+        """
+        for encoding in sorted(self.encodings, key=lambda e: len(self.encodings[e])):
+            if accept_encodings[encoding]:
+                return encoding, self.encodings[encoding]
+        return None, self.data
+
+
+class StaticAssets:
+    """
+    Fingerprinted static assets, built once at startup.
+    url(name) gives the immutable URL, get(fingerprinted_name) the asset it serves.
+    """
+    def __init__(self, folder, names, url_prefix='/assets/'):
+        self.url_prefix = url_prefix
+        self.by_name = {}
+        self.by_fingerprint = {}
+        for name in names:
+            asset = StaticAsset(folder, name)
+            self.by_name[name] = asset
+            self.by_fingerprint[asset.fingerprinted_name] = asset
+
+    def url(self, name):
+        asset = self.by_name.get(name)
+        if asset is None:
+            # Not fingerprinted, fall back to the plain route
+            return '/' + name
+        return self.url_prefix + asset.fingerprinted_name
+
+    def get(self, fingerprinted_name):
+        return self.by_fingerprint.get(fingerprinted_name)
@@ -0,0 +1,6 @@
+"""
+Benchmarks for ingest and the web app, run against a synthetic archive.
+
+    python -m benchmarks.archive OUT_DIR --channels 20 --posts 500
+    python -m benchmarks.bench --channels 20 --posts 500 --output results.json
+"""
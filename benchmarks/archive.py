@@ -0,0 +1,101 @@
+"""
+Synthetic post_root generator.
+
+Writes one directory per channel holding <post_id>.json files shaped like the
+archiver's output (what generate.prepare_file and database.extract_post read),
+plus <post_id>_<n>.jpg images and <post_id>.zip files as attachments.
+Output only depends on the arguments, so runs with the same seed are comparable.
+"""
+import argparse
+import json
+import os
+import random
+
+WORDS = ("community post update video stream today new merch thanks everyone "
+         "schedule collab announcement poll live tomorrow week members song cover art").split()
+
+EPOCH = 1600000000
+
+
+def make_post(rng, channel_id, channel_name, post_id, timestamp):
+    """
+    Post JSON in the archiver's format, with text runs, a link run and the usual metadata.
+    """
+    runs = [{"text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))) + "\n"}
+            for _ in range(rng.randint(1, 4))]
+    if rng.random() < 0.3:
+        runs.append({"text": "https://example.com/" + post_id,
+                     "urlEndpoint": {"url": "https://example.com/" + post_id}})
+    if rng.random() < 0.2:
+        runs.append({"text": "@" + channel_name,
+                     "navigationEndpoint": {"commandMetadata": {"webCommandMetadata": {"url": "/channel/" + channel_id}}}})
+
+    post = {
+        "post_id": post_id,
+        "channel_id": channel_id,
+        "author": {
+            "authorText": {"runs": [{"text": channel_name}]},
+            "authorThumbnail": {"thumbnails": [
+                {"url": f"https://yt3.ggpht.com/{channel_id}=s48-c-k", "width": 48, "height": 48},
+                {"url": f"https://yt3.ggpht.com/{channel_id}=s88-c-k", "width": 88, "height": 88},
+            ]},
+        },
+        "content_text": {"runs": runs},
+        "vote_count": {"simpleText": rng.choice(["0", "17", "842", "1.2K", "12K", "3,400"])},
+        "_published": {"lastUpdatedTimestamp": str(timestamp)},
+        # Bulk the archiver keeps but ingest ignores
+        "tracking_params": "x" * rng.randint(100, 400),
+        "action_buttons": {"menuRenderer": {"items": [{"text": w} for w in WORDS[:rng.randint(2, 10)]]}},
+    }
+    if rng.random() < 0.1:
+        post["sponsor_only_badge"] = {"sponsorsOnlyBadgeRenderer": {"label": {"simpleText": "Members only"}}}
+    return post
+
+
+def generate_archive(out_dir, channels=10, posts=100, images=2, files=0.1, image_bytes=2048, seed=1):
+    """
+    Writes channels * posts posts under out_dir. Each post gets 0..images images
+    (image_bytes of random data each) and a zip with probability files.
+    Returns the list of channel_ids.
+    """
+    rng = random.Random(seed)
+    channel_ids = []
+    for c in range(channels):
+        channel_id = f"UC{c:022d}"
+        channel_name = f"Channel {c}"
+        channel_ids.append(channel_id)
+        directory = os.path.join(out_dir, channel_id)
+        os.makedirs(directory, exist_ok=True)
+        for p in range(posts):
+            post_id = f"Ugkx{c:04d}{p:08d}"
+            timestamp = EPOCH + p * 3600 + c
+            with open(os.path.join(directory, post_id + ".json"), 'w', encoding='utf-8') as f:
+                json.dump(make_post(rng, channel_id, channel_name, post_id, timestamp), f)
+            for i in range(rng.randint(0, images)):
+                with open(os.path.join(directory, f"{post_id}_{i}.jpg"), 'wb') as f:
+                    f.write(rng.randbytes(image_bytes))
+            if rng.random() < files:
+                with open(os.path.join(directory, f"{post_id}.zip"), 'wb') as f:
+                    f.write(rng.randbytes(image_bytes))
+    return channel_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic archive generator")
+
+    parser.add_argument('out_dir', type=str, help='Directory to write the archive to (used as post_root)')
+
+    parser.add_argument('--channels', type=int, default=10, help="Number of channels (default: 10)")
+
+    parser.add_argument('--posts', type=int, default=100, help="Posts per channel (default: 100)")
+
+    parser.add_argument('--images', type=int, default=2, help="Maximum images per post (default: 2)")
+
+    parser.add_argument('--files', type=float, default=0.1, help="Share of posts with a zip attachment (default: 0.1)")
+
+    parser.add_argument('--seed', type=int, default=1, help="Random seed (default: 1)")
+
+    args = parser.parse_args()
+
+    generate_archive(args.out_dir, channels=args.channels, posts=args.posts, images=args.images,
+                     files=args.files, seed=args.seed)
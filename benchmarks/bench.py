@@ -0,0 +1,221 @@
+"""
+Ingest and route latency benchmark.
+
+Generates a synthetic archive (see benchmarks.archive), ingests it into a fresh
+SQLite database (or the empty database given with --database-url) and times:
+    ingest    posts/sec for a full run and for a rescan with nothing changed
+              (both use --incremental, so the first run records the manifest)
+    routes    latency percentiles per route, cold (all app caches cleared before
+              every request) and warm (repeated requests to a cached page)
+Routes go through Flask's test client, so times exclude the network and gunicorn.
+
+Results are printed as JSON (or written to --output) with the git commit and
+parameters, so runs can be compared between commits.
+
+    python -m benchmarks.bench --channels 20 --posts 500 --output before.json
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.archive import generate_archive
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(samples):
+    """
+    Count, mean and percentiles in milliseconds of a list of durations in seconds.
+    """
+    ordered = sorted(samples)
+
+    def percentile(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000, 3)
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_ingest(config_file, posts, workers, batch_size):
+    generate = importlib.import_module('generate')
+
+    start = time.perf_counter()
+    generate.main(config_file=config_file, workers=workers, batch_size=batch_size, incremental=True)
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generate.main(config_file=config_file, workers=workers, batch_size=batch_size, incremental=True)
+    rescan = time.perf_counter() - start
+
+    return {
+        "posts": posts,
+        "full_seconds": round(full, 3),
+        "full_posts_per_second": round(posts / full, 1),
+        "rescan_seconds": round(rescan, 3),
+        "rescan_posts_per_second": round(posts / rescan, 1),
+    }
+
+
+def reset_caches(web):
+    """
+    Drops every app-level cache, so the next request is rendered from the database.
+    """
+    web.cache.clear()
+    web.post_fragments.clear()
+    web.data_generation["checked"] = None
+
+
+def route_urls(web, app, channel_id, page_size=20):
+    """
+    {name: url} for the benchmarked routes, using the channel's first, middle and last posts.
+    """
+    from sqlalchemy import desc
+    from database import CommunityPost
+
+    with app.app_context():
+        query = web.db.session.query(CommunityPost)\
+            .filter(CommunityPost.channel_id == channel_id)\
+            .order_by(desc(CommunityPost.timestamp), desc(CommunityPost.post_id))
+        count = query.count()
+        last_page = max(1, (count + page_size - 1) // page_size)
+        deep = query.offset(max(0, (last_page - 1) * page_size - 1)).first()
+        middle = query.offset(count // 2).first()
+        deep_cursor = web.encode_cursor(deep)
+        middle_id = middle.post_id
+
+    return {
+        "index": "/",
+        "channel_first_page": f"/channel/{channel_id}",
+        "channel_deep_page": f"/channel/{channel_id}/page/{last_page}",
+        "channel_deep_cursor": f"/channel/{channel_id}?before={deep_cursor}",
+        "post": f"/post/{middle_id}",
+        "rss": "/rss/rss.xml",
+    }
+
+
+def bench_routes(web, app, urls, requests):
+    client = app.test_client()
+    results = {}
+    for name, url in urls.items():
+        timings = {"cold": [], "warm": []}
+        for mode in ("cold", "warm"):
+            reset_caches(web)
+            if mode == "warm":
+                client.get(url).get_data()
+            for _ in range(requests):
+                if mode == "cold":
+                    reset_caches(web)
+                start = time.perf_counter()
+                response = client.get(url)
+                response.get_data()
+                timings[mode].append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} returned {response.status_code}")
+        results[name] = {"url": url, "cold": summarize(timings["cold"]), "warm": summarize(timings["warm"])}
+    return results
+
+
+def run(work_dir, channels, posts, images, seed, requests, workers, batch_size, database_url=None):
+    post_root = os.path.join(work_dir, 'posts')
+    if os.path.exists(post_root):
+        shutil.rmtree(post_root)
+    start = time.perf_counter()
+    channel_ids = generate_archive(post_root, channels=channels, posts=posts, images=images, seed=seed)
+    archive_seconds = time.perf_counter() - start
+
+    if database_url is None:
+        database_file = os.path.join(work_dir, 'bench.db')
+        if os.path.exists(database_file):
+            os.remove(database_file)
+        database_url = 'sqlite:///' + database_file
+    # database.py and app.py read these at import
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['DATABASE_ADMIN_URL'] = database_url
+
+    config_file = os.path.join(work_dir, 'config.json')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump({"post_root": post_root, "web_root": "/files"}, f)
+
+    ingest = bench_ingest(config_file, channels * posts, workers, batch_size)
+
+    web = importlib.import_module('app')
+    app = web.create_app({'SQL_QUERY_LIMIT': 0})
+    routes = bench_routes(web, app, route_urls(web, app, channel_ids[len(channel_ids) // 2]), requests)
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "database": database_url.split(':', 1)[0],
+        "parameters": {"channels": channels, "posts_per_channel": posts, "images": images, "seed": seed,
+                       "requests": requests, "workers": workers, "batch_size": batch_size},
+        "archive_seconds": round(archive_seconds, 3),
+        "ingest": ingest,
+        "routes": routes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and route benchmark")
+
+    parser.add_argument('--channels', type=int, default=10, help="Number of channels (default: 10)")
+
+    parser.add_argument('--posts', type=int, default=200, help="Posts per channel (default: 200)")
+
+    parser.add_argument('--images', type=int, default=2, help="Maximum images per post (default: 2)")
+
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the archive (default: 1)")
+
+    parser.add_argument('--requests', type=int, default=50, help="Requests per route and mode (default: 50)")
+
+    parser.add_argument('--workers', type=int, default=1, help="Ingest --workers (default: 1)")
+
+    parser.add_argument('--batch-size', type=int, default=500, help="Ingest --batch-size (default: 500)")
+
+    parser.add_argument('--work-dir', type=str, default=None, help="Directory for the archive and SQLite file (default: a temporary directory)")
+
+    parser.add_argument('--database-url', type=str, default=None, help="Use this empty database (e.g. local MariaDB) instead of SQLite")
+
+    parser.add_argument('--output', type=str, default=None, help="Write the JSON results here instead of stdout")
+
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.path.insert(0, REPO_ROOT)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='community_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run(work_dir, args.channels, args.posts, args.images, args.seed, args.requests,
+                      args.workers, args.batch_size, database_url=args.database_url)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,149 @@
+"""
+Compares the post JSON backends (see postjson.py) on the same corpus.
+
+Each backend runs in its own process with its own SQLite database and reports
+    parse     read + load_post + database.extract_post over every file, no database
+    ingest    a full generate.py run
+plus a digest of the stored rows (community_posts, post_content_blocks,
+post_attachments, post_search, without autoincrement ids). The run fails unless
+every backend stored identical rows.
+
+    python -m benchmarks.json_backends --channels 20 --posts 500
+    python -m benchmarks.json_backends --post-root /path/to/archive --output json.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.archive import generate_archive
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPARED_TABLES = ('community_posts', 'post_content_blocks', 'post_attachments', 'post_search')
+
+
+def rows_digest(database_file):
+    """
+    {table: (row count, sha256 of the sorted rows)} for the compared tables, ignoring the id column.
+    """
+    connection = sqlite3.connect(database_file)
+    digests = {}
+    try:
+        for table in COMPARED_TABLES:
+            columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})") if row[1] != 'id']
+            rows = sorted(repr(row) for row in connection.execute(f"SELECT {', '.join(columns)} FROM {table}"))
+            digests[table] = (len(rows), hashlib.sha256("\n".join(rows).encode('utf-8')).hexdigest())
+    finally:
+        connection.close()
+    return digests
+
+
+def run_backend(backend, post_root, work_dir):
+    """
+    Child process: times parsing and ingest with one backend, returns its results.
+    """
+    database_file = os.path.join(work_dir, f"{backend}.db")
+    if os.path.exists(database_file):
+        os.remove(database_file)
+    os.environ['DATABASE_URL'] = os.environ['DATABASE_ADMIN_URL'] = 'sqlite:///' + database_file
+    sys.path.insert(0, REPO_ROOT)
+    import database
+    import generate
+    import postjson
+
+    files = sorted(str(path) for path in Path(post_root).rglob('*.json'))
+    start = time.perf_counter()
+    for file in files:
+        with open(file, 'rb') as f:
+            post = postjson.load_post(f.read(), backend)
+        if isinstance(post, dict):
+            database.extract_post(info=post, pictures=[], files=[], json_files=[])
+    parse = time.perf_counter() - start
+
+    config_file = os.path.join(work_dir, f"{backend}.json")
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump({"post_root": post_root, "web_root": "/files", "json_backend": backend}, f)
+    start = time.perf_counter()
+    generate.main(config_file=config_file)
+    ingest = time.perf_counter() - start
+
+    return {
+        "files": len(files),
+        "parse_seconds": round(parse, 3),
+        "parse_files_per_second": round(len(files) / parse, 1),
+        "ingest_seconds": round(ingest, 3),
+        "ingest_posts_per_second": round(len(files) / ingest, 1),
+        "rows": rows_digest(database_file),
+    }
+
+
+def compare(backends, post_root, work_dir):
+    results = {}
+    for backend in backends:
+        completed = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.json_backends', '--child', backend,
+             '--post-root', post_root, '--work-dir', work_dir],
+            cwd=REPO_ROOT, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            results[backend] = {"error": completed.stderr.strip().splitlines()[-1:]}
+            continue
+        results[backend] = json.loads(completed.stdout)
+
+    digests = {json.dumps(result.get("rows")) for result in results.values()}
+    identical = len(digests) == 1 and all("rows" in result for result in results.values())
+    return {"identical_rows": identical, "backends": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post JSON backend benchmark")
+
+    parser.add_argument('--backends', type=str, default='json,orjson,ijson', help="Comma separated backends to compare (default: json,orjson,ijson)")
+
+    parser.add_argument('--post-root', type=str, default=None, help="Existing archive to use instead of a synthetic one")
+
+    parser.add_argument('--channels', type=int, default=10, help="Channels in the synthetic archive (default: 10)")
+
+    parser.add_argument('--posts', type=int, default=200, help="Posts per channel in the synthetic archive (default: 200)")
+
+    parser.add_argument('--seed', type=int, default=1, help="Random seed for the synthetic archive (default: 1)")
+
+    parser.add_argument('--work-dir', type=str, default=None, help="Directory for the archive and databases (default: a temporary directory)")
+
+    parser.add_argument('--output', type=str, default=None, help="Write the JSON results here instead of stdout")
+
+    parser.add_argument('--child', type=str, default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_backend(args.child, args.post_root, args.work_dir)))
+        sys.exit(0)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='community_json_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        post_root = args.post_root
+        if post_root is None:
+            post_root = os.path.join(work_dir, 'posts')
+            shutil.rmtree(post_root, ignore_errors=True)
+            generate_archive(post_root, channels=args.channels, posts=args.posts, seed=args.seed)
+        results = compare(args.backends.split(','), os.path.abspath(post_root), work_dir)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(0 if results["identical_rows"] else 1)
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+import shutil
+import uuid
+
+HASH_CHUNK = 1024 * 1024
+READ_ONLY = 0o444
+
+# The store lives in this folder of post_root, so the app finds it in its files directory
+STORE_DIR = '_blobs'
+
+# URL name of a blob: the sha256 plus the original's extension, which only sets the Content-Type
+BLOB_NAME = re.compile(r'^([0-9a-f]{64})(\.[A-Za-z0-9]{1,10})?$')
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_path(blob_root, content_hash):
+    """
+    Where a blob lives in the store. No extension, so blobs of .json attachments
+    are never picked up as posts when the store is inside post_root.
+    """
+    return os.path.join(blob_root, content_hash[:2], content_hash)
+
+
+def blob_name(content_hash, file_path):
+    name = content_hash + os.path.splitext(file_path)[1].lower()
+    return name if BLOB_NAME.match(name) else content_hash
+
+
+def link_read_only(source, temporary):
+    """
+    Hardlinks source to temporary and makes the shared inode read-only, True if both worked.
+    """
+    try:
+        os.link(source, temporary)
+    except OSError:
+        return False
+    try:
+        os.chmod(temporary, READ_ONLY)
+    except OSError:
+        os.remove(temporary)
+        return False
+    return True
+
+
+def add_blob(source, blob_root, link=True):
+    """
+    Adds source to the store as a read-only file and returns its hash.
+    With link the blob is a hardlink to source, so it takes no extra space, falling back
+    to a copy when that fails (e.g. the store is on another filesystem or source isn't ours).
+    The stored file is hashed after it is made read-only, so the blob always matches its
+    name even if the source changed meanwhile; it is written under a temporary name and renamed.
+    """
+    temporary = os.path.join(blob_root, f".{uuid.uuid4().hex}.tmp")
+    os.makedirs(blob_root, exist_ok=True)
+    try:
+        if not (link and link_read_only(source, temporary)):
+            shutil.copy2(source, temporary)
+            os.chmod(temporary, READ_ONLY)
+        content_hash = hash_file(temporary)
+        target = blob_path(blob_root, content_hash)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(temporary)
+        else:
+            os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return content_hash
+
+
+def replace_with_link(target, path):
+    """
+    Replaces path by a hardlink to target, through a temporary name so path never goes missing.
+    """
+    temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+    os.link(target, temporary)
+    os.replace(temporary, path)
+
+
+def store_blob(source, blob_root, link_duplicates=True):
+    """
+    Adds one attachment to the content-addressed store and returns (content_hash, bytes_saved).
+    With link_duplicates (the default) each distinct file is stored once: the first original
+    becomes the blob through a hardlink and later duplicates are replaced by hardlinks to it,
+    so every copy of that content is one read-only inode. The scraper can still replace such a
+    file (write and rename), which leaves the blob alone, but can't rewrite it in place.
+    Without it blobs are independent read-only copies and the originals are left untouched.
+    Runs in the generate.py worker pool.
+    """
+    content_hash = hash_file(source)
+    target = blob_path(blob_root, content_hash)
+    if not os.path.exists(target) and add_blob(source, blob_root, link=link_duplicates) != content_hash:
+        # The source changed while it was copied, leave it alone and store it next run
+        raise RuntimeError(f"{source} changed while it was stored")
+    if not link_duplicates:
+        return content_hash, 0
+
+    source_stat = os.stat(source)
+    target_stat = os.stat(target)
+    if os.path.samestat(source_stat, target_stat) or source_stat.st_dev != target_stat.st_dev:
+        return content_hash, 0
+    replace_with_link(target, source)
+    # Only counts if this was the last name of the old copy
+    return content_hash, source_stat.st_size if source_stat.st_nlink == 1 else 0
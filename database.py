@@ -1,13 +1,17 @@
 from datetime import datetime
-from sqlalchemy import (
-    create_engine, Column, String, Text, Integer, Boolean, DateTime, ForeignKey, select, Index 
-)
-from sqlalchemy.orm import relationship, sessionmaker 
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import create_engine, select, update, exists, func, tuple_
+from sqlalchemy.orm import sessionmaker, scoped_session
 
 from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.dialects import sqlite, postgresql
 import re
 import logging
+import metrics
+from postids import PostIdIndex
+from models import (
+    Base, CommunityPost, PostAttachment, PostContentBlock, AttachmentVariant, PostSearch, IngestManifest,
+    ChannelSummary, AppState, DATA_GENERATION, create_missing_columns, create_missing_indexes
+)
 
 import os
 from dotenv import load_dotenv
@@ -15,124 +19,43 @@ load_dotenv()
 # --- 1. Database Setup ---
 # Using SQLite for this example, but you can swap the connection string for MySQL/Postgres
 DATABASE_URL = os.getenv('DATABASE_ADMIN_URL', os.getenv('DATABASE_URL')) 
-Base = declarative_base()
-
-# --- 2. Define Models ---
-
-class CommunityPost(Base):
-    __tablename__ = 'community_posts'
-
-    post_id = Column(String(50), primary_key=True)
-    channel_id = Column(String(24), nullable=False)
-    channel_name = Column(Text, nullable=True)
-    profile_pic_url = Column(Text, nullable=True)
-    timestamp = Column(DateTime, nullable=False)
-    likes_count = Column(Integer, default=0)
-    is_members_only = Column(Boolean, default=False)
-
-    __table_args__ = (
-        Index('Date_index', 'post_id', 'timestamp'),
-        Index('timestamp', 'timestamp'),
-        {
-            'mysql_engine': 'InnoDB',
-            'mysql_charset': 'utf8mb4',
-            'mysql_collate': 'utf8mb4_unicode_ci'
-        }
-    )
-
-    content_blocks = relationship(
-        "PostContentBlock",
-        back_populates="post",
-        order_by="PostContentBlock.id",
-        cascade="all, delete-orphan"
-    )
-    attachments = relationship(
-        "PostAttachment",
-        back_populates="post",
-        order_by="PostAttachment.id",
-        cascade="all, delete-orphan"
-    )
-
-
-class PostAttachment(Base):
-    __tablename__ = 'post_attachments'
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    post_id = Column(String(50), ForeignKey('community_posts.post_id'), nullable=False, index=True)
-    file_type = Column(String(10), nullable=True)
-    file_path = Column(Text, nullable=False)
-
-    __table_args__ = (
-        # FIX: Changed UniqueConstraint to Index with unique=True
-        Index(
-            'unique_post_file', 
-            'post_id', 'file_path', 
-            unique=True, 
-            mysql_using='hash'
-        ),
-        Index('attachment_post_id_sequence', 'post_id', 'id'),
-        {
-            'mysql_engine': 'InnoDB',
-            'mysql_charset': 'utf8mb4',
-            'mysql_collate': 'utf8mb4_unicode_ci'
-        }
-    )
-
-    post = relationship("CommunityPost", back_populates="attachments")
-
-
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Index, UniqueConstraint
-from sqlalchemy.orm import relationship
-
-class PostContentBlock(Base):
-    __tablename__ = 'post_content_blocks'
-
-    # Matching: `id` int(11) NOT NULL AUTO_INCREMENT
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    
-    # Matching text fields: DEFAULT NULL
-    text_content = Column(Text, nullable=True)
-    link_url = Column(Text, nullable=True)
-    
-    # Matching: `post_id` varchar(50) DEFAULT NULL
-    post_id = Column(
-        String(50), 
-        ForeignKey(
-            'community_posts.post_id', 
-            name='post_id', 
-            ondelete='NO ACTION', 
-            onupdate='NO ACTION'
-        ),
-        nullable=True
-    )
-    
-    # Matching: `block_index` int(11) NOT NULL DEFAULT 0
-    block_index = Column(Integer, nullable=False, server_default='0')
-
-    __table_args__ = (
-        # Matching: UNIQUE KEY `unique_content_per_post` (`post_id`,`text_content`,`link_url`,`block_index`) USING HASH
-        Index(
-            'unique_content_per_post', 
-            'post_id', 'text_content', 'link_url', 'block_index', 
-            unique=True, 
-            mysql_using='hash'
-        ),
-        
-        Index('post_id_idx', 'post_id'),
-        Index('id_post_id', 'id', 'post_id'),
-        {
-            'mysql_engine': 'InnoDB',
-            'mysql_charset': 'utf8mb4',
-        }
-    )
-
-    post = relationship("CommunityPost", back_populates="content_blocks")
-
-# Create Engine and Tables
-engine = create_engine(DATABASE_URL)
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
-session = Session()
+
+# --- 2. Engine and Session ---
+# Nothing connects at import time: the engine is created on first use, and each process
+# gets its own session (a forked worker never reuses its parent's).
+engine_state = {"engine": None}
+
+def get_engine():
+    if engine_state["engine"] is None:
+        engine_state["engine"] = create_engine(DATABASE_URL)
+    return engine_state["engine"]
+
+def dispose_engine():
+    """
+    Drops the pooled connections after a fork without closing the parent's,
+    the next query opens a fresh one in this process.
+    """
+    if engine_state["engine"] is not None:
+        engine_state["engine"].dispose(close=False)
+
+def __getattr__(name):
+    # database.engine, kept for callers that used the old module-level engine
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+Session = sessionmaker()
+session = scoped_session(lambda: Session(bind=get_engine()), scopefunc=os.getpid)
+
+def init_db(bind=None):
+    """
+    Creates missing tables and indexes. Run explicitly (generate.py, `flask --app app init-db`),
+    never on import.
+    """
+    bind = bind or get_engine()
+    Base.metadata.create_all(bind)
+    create_missing_columns(bind)
+    create_missing_indexes(bind)
 
 # --- 3. Parsing & Storage Logic ---
 def parse_shorthand(value):
@@ -155,109 +78,634 @@ def parse_shorthand(value):
     # If no suffix, just convert to float then int
     return int(float(value))
 
-def store_post(info:dict , pictures=[], files=[], json_files=[]):
+def extract_post(info:dict , pictures=[], files=[], json_files=[]):
+    """
+    Builds the rows stored for a single post without touching the database.
+    Returns a dict with the 'post' values and the 'blocks' and 'attachments' row lists.
+    This is safe to run in a worker process; write_post does the inserts.
+    """
     post_id = info['post_id']
 
     # --- 1. Extract Metadata (Same as your original logic) ---
-    try:
-        # Safely navigate to the last thumbnail URL
-        author_thumb = (info.get('author', {}) \
-                        .get('authorThumbnail', {}) or {} ) \
-                        .get('thumbnails', [{}])[-1] \
-                        .get('url', None) \
-                        or \
-                        (info.get("original_post") \
-                        .get('author', {}) \
-                        .get('authorThumbnail', {}) or {} ) \
-                        .get('thumbnails', [{}])[-1] \
-                        .get('url')
-        # Replace thumbnail url for maximum resolution
-        if author_thumb:            
-            author_thumb = re.sub(r'(.*)=s.*', r'\1=s0', author_thumb)
-        # Safely navigate to the channel name text
-        chan_name = (info.get('author', {}) \
-                        .get('authorText', {}) or {} ) \
-                        .get('runs', [{}])[0] \
-                        .get('text', None) \
-                        or \
-                        (info.get("original_post") \
-                        .get('author', {}) \
-                        .get('authorText', {}) or {} ) \
-                        .get('runs', [{}])[0] \
-                        .get('text', 'Unknown')
-        
-        
-        # Safe Like Conversion
-        likes_text = (info.get('vote_count', {}) or {}).get('simpleText', None)
-        likes = parse_shorthand(likes_text.replace(',', '')) if likes_text else 0
-        
-        # Timestamp
-        ts = (info.get('_published', {}) or {}).get('lastUpdatedTimestamp')
-        timestamp = datetime.fromtimestamp(int(ts)) if ts else datetime.now(datetime.timezone.utc)
-
-        # --- 2. Insert Parent (INSERT IGNORE) ---
-        post_values = {
-            "post_id": post_id,
-            "channel_id": info.get('channel_id'),
-            "channel_name": chan_name,
-            "profile_pic_url": author_thumb,
-            "timestamp": timestamp,
-            "likes_count": likes,
-            "is_members_only": (info.get('sponsor_only_badge') is not None)
-        }
-
-        # Using prefix_with("IGNORE") for MariaDB
-        parent_stmt = insert(CommunityPost).values(post_values).prefix_with("IGNORE")
-        session.execute(parent_stmt)
-
-        # --- 3. Insert Content Blocks (INSERT IGNORE) ---
-        if info.get('content_text', {}).get('runs'):
-            block_list = []
-            # Use enumerate to create the block_index automatically
-            for i, run in enumerate(info['content_text']['runs']):
-                url = None
-                if run.get('urlEndpoint'):
-                    url = run['urlEndpoint'].get('url')
-                elif run.get('browseEndpoint'):
-                    url = "https://youtube.com" + run['browseEndpoint'].get('url', '')
-                elif run.get('navigationEndpoint'):
-                    cmd_meta = run.get('navigationEndpoint', {}).get('commandMetadata', {}).get('webCommandMetadata', {})
-                    if cmd_meta.get('url'):
-                        url = "https://youtube.com" + cmd_meta['url']
-                
-                block_list.append({
-                    "post_id": post_id,
-                    "block_index": i,  # Adding the enumeration here
-                    "text_content": run.get('text', ''),
-                    "link_url": url 
-                })
+    # Safely navigate to the last thumbnail URL
+    author_thumb = (info.get('author', {}) \
+                    .get('authorThumbnail', {}) or {} ) \
+                    .get('thumbnails', [{}])[-1] \
+                    .get('url', None) \
+                    or \
+                    (info.get("original_post") \
+                    .get('author', {}) \
+                    .get('authorThumbnail', {}) or {} ) \
+                    .get('thumbnails', [{}])[-1] \
+                    .get('url')
+    # Replace thumbnail url for maximum resolution
+    if author_thumb:            
+        author_thumb = re.sub(r'(.*)=s.*', r'\1=s0', author_thumb)
+    # Safely navigate to the channel name text
+    chan_name = (info.get('author', {}) \
+                    .get('authorText', {}) or {} ) \
+                    .get('runs', [{}])[0] \
+                    .get('text', None) \
+                    or \
+                    (info.get("original_post") \
+                    .get('author', {}) \
+                    .get('authorText', {}) or {} ) \
+                    .get('runs', [{}])[0] \
+                    .get('text', 'Unknown')
+    
+    
+    # Safe Like Conversion
+    likes_text = (info.get('vote_count', {}) or {}).get('simpleText', None)
+    likes = parse_shorthand(likes_text.replace(',', '')) if likes_text else 0
+    
+    # Timestamp
+    ts = (info.get('_published', {}) or {}).get('lastUpdatedTimestamp')
+    timestamp = datetime.fromtimestamp(int(ts)) if ts else datetime.now(datetime.timezone.utc)
+
+    # --- 2. Parent Row ---
+    post_values = {
+        "post_id": post_id,
+        "channel_id": info.get('channel_id'),
+        "channel_name": chan_name,
+        "profile_pic_url": author_thumb,
+        "timestamp": timestamp,
+        "likes_count": likes,
+        "is_members_only": (info.get('sponsor_only_badge') is not None)
+    }
+
+    # --- 3. Content Blocks ---
+    block_list = []
+    if info.get('content_text', {}).get('runs'):
+        # Use enumerate to create the block_index automatically
+        for i, run in enumerate(info['content_text']['runs']):
+            url = None
+            if run.get('urlEndpoint'):
+                url = run['urlEndpoint'].get('url')
+            elif run.get('browseEndpoint'):
+                url = "https://youtube.com" + run['browseEndpoint'].get('url', '')
+            elif run.get('navigationEndpoint'):
+                cmd_meta = run.get('navigationEndpoint', {}).get('commandMetadata', {}).get('webCommandMetadata', {})
+                if cmd_meta.get('url'):
+                    url = "https://youtube.com" + cmd_meta['url']
             
-            if block_list:
-                block_stmt = insert(PostContentBlock).values(block_list).prefix_with("IGNORE")
-                session.execute(block_stmt)
-
-        # --- 4. Insert Attachments (INSERT IGNORE) ---
-        attachment_list = []
-        for f_path in json_files:
-            attachment_list.append({"post_id": post_id, "file_type": 'JSON', "file_path": f_path})
-        for f_path in pictures:
-            attachment_list.append({"post_id": post_id, "file_type": 'IMAGE', "file_path": f_path})
-        for f_path in files:
-            attachment_list.append({"post_id": post_id, "file_type": 'FILE', "file_path": f_path})
-
-        if attachment_list:
-            attr_stmt = insert(PostAttachment).values(attachment_list).prefix_with("IGNORE")
-            session.execute(attr_stmt)
+            block_list.append({
+                "post_id": post_id,
+                "block_index": i,  # Adding the enumeration here
+                "text_content": run.get('text', ''),
+                "link_url": url 
+            })
+
+    # --- 4. Attachments ---
+    attachment_list = []
+    for f_path in json_files:
+        attachment_list.append({"post_id": post_id, "file_type": 'JSON', "file_path": f_path})
+    for f_path in pictures:
+        attachment_list.append({"post_id": post_id, "file_type": 'IMAGE', "file_path": f_path})
+    for f_path in files:
+        attachment_list.append({"post_id": post_id, "file_type": 'FILE', "file_path": f_path})
+
+    return {"post": post_values, "blocks": block_list, "attachments": attachment_list}
+
+def search_row(record):
+    """
+    post_search row for a record built by extract_post, None if the post has no text.
+    """
+    if not record["post"]:
+        return None
+    body = "\n".join(block["text_content"] for block in record["blocks"] if block["text_content"])
+    if not body.strip():
+        return None
+    return {"post_id": record["post"]["post_id"], "channel_id": record["post"]["channel_id"], "body": body}
+
+# Rows per INSERT statement, keeps multi-row inserts under placeholder/packet limits
+INSERT_CHUNK_ROWS = 1000
 
+def insert_ignore(model):
+    """
+    INSERT that skips rows whose keys already exist.
+    MariaDB/MySQL use INSERT IGNORE, SQLite needs INSERT OR IGNORE.
+    """
+    stmt = insert(model)
+    if session.get_bind().dialect.name == 'sqlite':
+        return stmt.prefix_with("OR IGNORE")
+    return stmt.prefix_with("IGNORE")
+
+def upsert(model, rows, index_elements):
+    """
+    INSERT that overwrites the non-key columns of rows whose keys already exist.
+    Uses ON DUPLICATE KEY UPDATE on MariaDB/MySQL and ON CONFLICT DO UPDATE elsewhere.
+    """
+    update_columns = [column for column in rows[0] if column not in index_elements]
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        stmt = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(model).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    stmt = insert(model).values(rows)
+    return stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in update_columns})
+
+class PostChanges:
+    """
+    What the ingest path did with the posts it was given: post_ids inserted, post_ids updated
+    (stored values, blocks, attachments or search text differed) and how many were left unchanged.
+    channels holds every channel with an inserted or updated post, the only ones whose
+    channel_summary.updated_at moves and so whose cached pages and fragments go stale.
+    """
+    def __init__(self):
+        self.inserted = set()
+        self.updated = set()
+        self.unchanged = 0
+        self.channels = set()
+
+    def __len__(self):
+        return len(self.inserted) + len(self.updated)
+
+    def update(self, other):
+        self.inserted |= other.inserted
+        self.updated |= other.updated
+        self.unchanged += other.unchanged
+        self.channels |= other.channels
+
+    def __str__(self):
+        return f"{len(self.inserted)} new, {len(self.updated)} updated, {self.unchanged} unchanged posts in {len(self.channels)} changed channels"
+
+def record_state(record):
+    """
+    The parts of a record compared against stored_posts, in the same shape.
+    """
+    search = search_row(record)
+    return {
+        "post": record["post"],
+        "blocks": sorted((block["block_index"], block["text_content"], block["link_url"]) for block in record["blocks"]),
+        "attachments": {(attachment["file_type"], attachment["file_path"]) for attachment in record["attachments"]},
+        "search": search["body"] if search else None,
+    }
+
+def stored_posts(post_ids):
+    """
+    What is stored for post_ids, shaped like record_state: {post_id: state}.
+    One query per table per chunk; posts that aren't stored are missing from the result.
+    """
+    post_ids = list(post_ids)
+    stored = {}
+    for start in range(0, len(post_ids), INSERT_CHUNK_ROWS):
+        chunk = post_ids[start:start + INSERT_CHUNK_ROWS]
+        for row in session.execute(select(CommunityPost.__table__).where(CommunityPost.post_id.in_(chunk))):
+            stored[row.post_id] = {"post": dict(row._mapping), "blocks": [], "attachments": set(), "search": None}
+        found = [post_id for post_id in chunk if post_id in stored]
+        if not found:
+            continue
+        for row in session.execute(
+            select(PostContentBlock.post_id, PostContentBlock.block_index, PostContentBlock.text_content, PostContentBlock.link_url)
+            .where(PostContentBlock.post_id.in_(found))
+        ):
+            stored[row.post_id]["blocks"].append((row.block_index, row.text_content, row.link_url))
+        for row in session.execute(
+            select(PostAttachment.post_id, PostAttachment.file_type, PostAttachment.file_path)
+            .where(PostAttachment.post_id.in_(found))
+        ):
+            stored[row.post_id]["attachments"].add((row.file_type, row.file_path))
+        for row in session.execute(select(PostSearch.post_id, PostSearch.body).where(PostSearch.post_id.in_(found))):
+            stored[row.post_id]["search"] = row.body
+    for state in stored.values():
+        state["blocks"].sort()
+    return stored
+
+def post_changed(state, stored):
+    """
+    Names of the parts of a post that differ from what is stored, only the columns the record sets count.
+    """
+    changed = [part for part in ("blocks", "attachments", "search") if state[part] != stored[part]]
+    if any(stored["post"].get(column) != value for column, value in state["post"].items()):
+        changed.append("post")
+    return changed
+
+def apply_records(batch):
+    """
+    Writes the records of batch that are new or differ from what is stored, in the caller's transaction.
+    New posts are inserted as before; a changed post only has the changed parts rewritten: its row is
+    upserted, its blocks or attachments are replaced and its search row upserted or removed.
+    Unchanged posts cost one read and no writes. Returns the PostChanges of the batch.
+    """
+    changes = PostChanges()
+    # The last record wins if a post appears twice
+    records = {record["post"]["post_id"]: record for record in batch if record["post"]}
+    stored = stored_posts(records)
+
+    new_records = []
+    rewrite = {"post": [], "blocks": [], "attachments": [], "search": []}
+    for post_id, record in records.items():
+        if post_id not in stored:
+            new_records.append(record)
+            changes.inserted.add(post_id)
+            changes.channels.add(record["post"]["channel_id"])
+            continue
+        changed = post_changed(record_state(record), stored[post_id])
+        if not changed:
+            changes.unchanged += 1
+            continue
+        for part in changed:
+            rewrite[part].append(record)
+        changes.updated.add(post_id)
+        # Both channels change if the post moved
+        changes.channels.update({record["post"]["channel_id"], stored[post_id]["post"]["channel_id"]})
+
+    for model, key in ((CommunityPost, "post"), (PostContentBlock, "blocks"), (PostAttachment, "attachments"), (PostSearch, "search")):
+        if key == "post":
+            rows = [record["post"] for record in new_records]
+        elif key == "search":
+            rows = [row for row in map(search_row, new_records) if row]
+        else:
+            rows = [row for record in new_records for row in record[key]]
+        for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+            session.execute(insert_ignore(model).values(rows[start:start + INSERT_CHUNK_ROWS]))
+
+    rows = [record["post"] for record in rewrite["post"]]
+    for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+        session.execute(upsert(CommunityPost, rows[start:start + INSERT_CHUNK_ROWS], ['post_id']))
+
+    for model, key in ((PostContentBlock, "blocks"), (PostAttachment, "attachments")):
+        post_ids = [record["post"]["post_id"] for record in rewrite[key]]
+        for start in range(0, len(post_ids), INSERT_CHUNK_ROWS):
+            session.execute(model.__table__.delete().where(model.post_id.in_(post_ids[start:start + INSERT_CHUNK_ROWS])))
+        rows = [row for record in rewrite[key] for row in record[key]]
+        for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+            session.execute(insert_ignore(model).values(rows[start:start + INSERT_CHUNK_ROWS]))
+
+    rows = [row for row in map(search_row, rewrite["search"]) if row]
+    for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+        session.execute(upsert(PostSearch, rows[start:start + INSERT_CHUNK_ROWS], ['post_id']))
+    emptied = [record["post"]["post_id"] for record in rewrite["search"] if not search_row(record)]
+    if emptied:
+        session.execute(PostSearch.__table__.delete().where(PostSearch.post_id.in_(emptied)))
+
+    manifest_rows = [record["manifest"] for record in batch if record.get("manifest")]
+    for start in range(0, len(manifest_rows), INSERT_CHUNK_ROWS):
+        session.execute(upsert(IngestManifest, manifest_rows[start:start + INSERT_CHUNK_ROWS], ['path']))
+
+    # Only channels that changed get a new updated_at, which is what invalidates their cached pages
+    refresh_channel_summaries(changes.channels)
+    return changes
+
+def write_post(record, changes=None):
+    """
+    Stores a record built by extract_post and commits, see apply_records.
+    Records with a 'manifest' entry also update the ingest manifest in the same transaction.
+    Errors are logged and rolled back so one bad post doesn't stop an ingest run.
+    Returns True if the record was stored (written or found unchanged).
+    """
+    post_id = record["post"]["post_id"] if record["post"] else record["manifest"]["post_id"]
+    try:
+        record_changes = apply_records([record])
         session.commit()
-        logging.info(f"Processed Post ID: {post_id}")
+        if changes is not None:
+            changes.update(record_changes)
+        if record_changes:
+            logging.info(f"Processed Post ID: {post_id}")
+        return True
 
     except Exception as e:
         session.rollback()
         logging.exception(f"Critical error storing Post ID {post_id}: {e}")
+        metrics.ingest_error('write')
+        return False
+
+def write_batch(batch, changes=None):
+    """
+    Stores several records with a few multi-row statements per table and a single commit, see apply_records.
+    If the batch fails it is rolled back and retried post by post, so only the bad records are lost.
+    Adds what was done to changes if given. Returns the number of posts inserted or updated.
+    """
+    try:
+        batch_changes = apply_records(batch)
+        session.commit()
+        logging.info(f"Processed batch: {batch_changes}")
+
+    except Exception as e:
+        session.rollback()
+        logging.warning(f"Batch of {len(batch)} posts failed, retrying individually: {e}")
+        batch_changes = PostChanges()
+        for record in batch:
+            write_post(record, batch_changes)
+
+    if changes is not None:
+        changes.update(batch_changes)
+    return len(batch_changes)
+
+def store_posts(records, batch_size=500, changes=None):
+    """
+    Stores records built by extract_post, committing once per batch_size posts.
+    records can be any iterable, including a generator fed by an ingest pipeline.
+    Collects what was inserted and updated in changes (a PostChanges) if given.
+    Returns the number of posts inserted or updated.
+    """
+    written = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            written += write_batch(batch, changes)
+            batch = []
+    if batch:
+        written += write_batch(batch, changes)
+    return written
+
+def store_post(info:dict , pictures=[], files=[], json_files=[]):
+    post_id = info['post_id']
+    try:
+        record = extract_post(info, pictures=pictures, files=files, json_files=json_files)
+    except Exception as e:
+        logging.exception(f"Critical error storing Post ID {post_id}: {e}")
+        return
+    write_post(record)
+
+# Channels per summary refresh query
+SUMMARY_CHUNK = 500
+
+def refresh_channel_summaries(channel_ids):
+    """
+    Recomputes the channel_summary rows for channel_ids from community_posts, removing the rows
+    of channels left without posts (e.g. their last post moved). Runs in the caller's transaction; each chunk is one grouped query over the
+    (channel_id, timestamp) index, one query for the latest posts and one upsert.
+    """
+    channel_ids = [channel_id for channel_id in channel_ids if channel_id]
+    now = datetime.now()
+    for start in range(0, len(channel_ids), SUMMARY_CHUNK):
+        chunk = channel_ids[start:start + SUMMARY_CHUNK]
+        stats = select(
+            CommunityPost.channel_id,
+            func.count(CommunityPost.post_id).label('post_count'),
+            func.max(CommunityPost.timestamp).label('max_ts')
+        ).where(CommunityPost.channel_id.in_(chunk)).group_by(CommunityPost.channel_id).subquery()
+
+        latest = session.execute(
+            select(
+                CommunityPost.channel_id,
+                CommunityPost.channel_name,
+                CommunityPost.profile_pic_url,
+                stats.c.max_ts,
+                stats.c.post_count
+            ).join(
+                stats,
+                (CommunityPost.channel_id == stats.c.channel_id) &
+                (CommunityPost.timestamp == stats.c.max_ts)
+            )
+        )
+
+        rows = {}
+        for row in latest:
+            # Several posts can share the latest timestamp, any of them will do
+            rows[row.channel_id] = {
+                "channel_id": row.channel_id,
+                "channel_name": row.channel_name,
+                "profile_pic_url": row.profile_pic_url,
+                "latest_timestamp": row.max_ts,
+                "post_count": row.post_count,
+                "updated_at": now
+            }
+        if rows:
+            session.execute(upsert(ChannelSummary, list(rows.values()), ['channel_id']))
+        emptied = [channel_id for channel_id in chunk if channel_id not in rows]
+        if emptied:
+            session.execute(ChannelSummary.__table__.delete().where(ChannelSummary.channel_id.in_(emptied)))
+
+def rebuild_channel_summaries():
+    """
+    Rebuilds channel_summary from scratch, for existing databases or after manual edits.
+    """
+    try:
+        channel_ids = list(session.scalars(select(CommunityPost.channel_id).distinct()))
+        session.execute(ChannelSummary.__table__.delete())
+        refresh_channel_summaries(channel_ids)
+        session.commit()
+        logging.info(f"Rebuilt channel summary for {len(channel_ids)} channels")
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Error rebuilding channel summary: {e}")
+
+def channel_summary_missing():
+    """
+    True if there are posts but no channel summary, e.g. the first run after upgrading.
+    """
+    return session.scalar(select(ChannelSummary.channel_id).limit(1)) is None and \
+        session.scalar(select(CommunityPost.post_id).limit(1)) is not None
+
+def rebuild_search_index(chunk_size=INSERT_CHUNK_ROWS):
+    """
+    Rebuilds post_search from the stored content blocks, for existing databases or after manual edits.
+    """
+    try:
+        session.execute(PostSearch.__table__.delete())
+        indexed = 0
+        last_post_id = ''
+        while True:
+            chunk = session.execute(
+                select(CommunityPost.post_id, CommunityPost.channel_id)
+                .where(CommunityPost.post_id > last_post_id)
+                .order_by(CommunityPost.post_id).limit(chunk_size)
+            ).all()
+            if not chunk:
+                break
+            last_post_id = chunk[-1].post_id
+            blocks = {}
+            for row in session.execute(
+                select(PostContentBlock.post_id, PostContentBlock.text_content)
+                .where(PostContentBlock.post_id.in_([post.post_id for post in chunk]))
+                .order_by(PostContentBlock.post_id, PostContentBlock.block_index)
+            ):
+                blocks.setdefault(row.post_id, []).append({"text_content": row.text_content})
+            rows = [search_row({"post": {"post_id": post.post_id, "channel_id": post.channel_id},
+                                "blocks": blocks.get(post.post_id, [])}) for post in chunk]
+            rows = [row for row in rows if row]
+            if rows:
+                session.execute(insert_ignore(PostSearch).values(rows))
+                indexed += len(rows)
+        session.commit()
+        logging.info(f"Rebuilt search index for {indexed} posts")
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Error rebuilding search index: {e}")
+
+def search_index_missing():
+    """
+    True if there is post content but nothing in post_search, e.g. the first run after upgrading.
+    """
+    return session.scalar(select(PostSearch.id).limit(1)) is None and \
+        session.scalar(select(PostContentBlock.id).limit(1)) is not None
+
+def bump_data_generation():
+    """
+    Increments the data generation so every web worker drops its cached pages.
+    """
+    try:
+        result = session.execute(
+            update(AppState).where(AppState.name == DATA_GENERATION).values(value=AppState.value + 1)
+        )
+        if result.rowcount == 0:
+            session.execute(insert_ignore(AppState).values(name=DATA_GENERATION, value=1))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Error bumping data generation: {e}")
+
+# format of the marker row of an image that couldn't be read or resized, see AttachmentVariant.
+# Not picked up again unless thumbnails are refreshed.
+THUMBNAIL_FAILED = 'failed'
+
+def get_images_for_thumbnails(all_images=False, post_ids=None):
+    """
+    Returns (post_id, file_path) for IMAGE attachments, by default only those without any variant
+    or marker rows yet.
+    post_ids limits it to those posts' attachments, e.g. the ones an ingest just wrote.
+    """
+    stmt = select(PostAttachment.post_id, PostAttachment.file_path).where(PostAttachment.file_type == 'IMAGE')
+    if not all_images:
+        stmt = stmt.where(~exists().where(
+            AttachmentVariant.post_id == PostAttachment.post_id,
+            AttachmentVariant.file_path == PostAttachment.file_path
+        ))
+    if post_ids is None:
+        return session.execute(stmt).all()
+    post_ids = list(post_ids)
+    images = []
+    for start in range(0, len(post_ids), INSERT_CHUNK_ROWS):
+        images += session.execute(stmt.where(PostAttachment.post_id.in_(post_ids[start:start + INSERT_CHUNK_ROWS]))).all()
+    return images
+
+def store_variants(rows, changes=None):
+    """
+    Records resized image variants and refreshes their channels' summaries,
+    so cached pages and fragments pick the new images up.
+    rows hold every variant of their images: older rows of an image that now has copies
+    (marker rows, or copies under an earlier naming) are replaced.
+    The posts are added to changes as updated, their pages render differently now.
+    Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    try:
+        resized = list({(row["post_id"], row["file_path"]) for row in rows if row["variant_path"] != row["file_path"]})
+        for start in range(0, len(resized), INSERT_CHUNK_ROWS):
+            session.execute(AttachmentVariant.__table__.delete().where(
+                tuple_(AttachmentVariant.post_id, AttachmentVariant.file_path).in_(resized[start:start + INSERT_CHUNK_ROWS])
+            ))
+        for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+            session.execute(upsert(AttachmentVariant, rows[start:start + INSERT_CHUNK_ROWS], ['post_id', 'variant_path']))
+        # Marker rows alone don't change how a post renders
+        post_ids = {row["post_id"] for row in rows if row["variant_path"] != row["file_path"]}
+        channel_ids = channels_of_posts(post_ids)
+        refresh_channel_summaries(channel_ids)
+        session.commit()
+        if changes is not None:
+            changes.updated |= post_ids - changes.inserted
+            changes.channels |= channel_ids
+        logging.info(f"Stored {len(rows)} image variants")
+        return len(rows)
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Error storing image variants: {e}")
+        return 0
+
+# content_hash of an attachment that couldn't be stored (missing or unreadable file).
+# Not picked up again; replacing the post's attachments (a changed re-scrape) resets it.
+BLOB_FAILED = ''
+
+def get_unhashed_attachments(post_ids=None):
+    """
+    Returns (id, post_id, file_path) for IMAGE and FILE attachments not in the blob store yet,
+    only those of post_ids if given. The post JSON files themselves are left where they are.
+    """
+    stmt = select(PostAttachment.id, PostAttachment.post_id, PostAttachment.file_path)\
+        .where(PostAttachment.content_hash.is_(None), PostAttachment.file_type.in_(('IMAGE', 'FILE')))\
+        .order_by(PostAttachment.id)
+    if post_ids is None:
+        return session.execute(stmt).all()
+    post_ids = list(post_ids)
+    attachments = []
+    for start in range(0, len(post_ids), INSERT_CHUNK_ROWS):
+        attachments += session.execute(stmt.where(PostAttachment.post_id.in_(post_ids[start:start + INSERT_CHUNK_ROWS]))).all()
+    return attachments
+
+def store_attachment_hashes(rows):
+    """
+    Records content hashes, rows are {"id", "post_id", "content_hash"}, and refreshes the channels'
+    summaries so cached pages switch to the /blob/ URLs.
+    Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    try:
+        for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+            chunk = rows[start:start + INSERT_CHUNK_ROWS]
+            session.execute(update(PostAttachment), [{"id": row["id"], "content_hash": row["content_hash"]} for row in chunk])
+        refresh_channel_summaries(channels_of_posts({row["post_id"] for row in rows}))
+        session.commit()
+        logging.info(f"Stored {len(rows)} attachment hashes")
+        return len(rows)
+    except Exception as e:
+        session.rollback()
+        logging.exception(f"Error storing attachment hashes: {e}")
+        return 0
+
+def channels_of_posts(post_ids):
+    post_ids = list(post_ids)
+    channel_ids = set()
+    for start in range(0, len(post_ids), INSERT_CHUNK_ROWS):
+        channel_ids.update(session.scalars(
+            select(CommunityPost.channel_id).where(CommunityPost.post_id.in_(post_ids[start:start + INSERT_CHUNK_ROWS]))
+        ))
+    return channel_ids
+
+def get_manifest(paths=None):
+    """
+    Returns the ingest manifest as {path: row} with size, mtime_ns, content_hash and post_id,
+    optionally limited to the given paths.
+    Plain rows rather than ORM objects, this can cover the whole archive.
+    """
+    stmt = select(IngestManifest.path, IngestManifest.size, IngestManifest.mtime_ns,
+                  IngestManifest.content_hash, IngestManifest.post_id)
+    if paths is not None:
+        stmt = stmt.where(IngestManifest.path.in_(list(paths)))
+    return {row.path: row for row in session.execute(stmt)}
+
+# post_ids per query when streaming or confirming ids
+POST_ID_CHUNK = 50000
+CONFIRM_CHUNK = 1000
+
+def iter_post_ids(chunk_size=POST_ID_CHUNK):
+    """
+    Yields every post_id, read in keyset chunks so the result set is never held at once.
+    """
+    last_post_id = None
+    while True:
+        stmt = select(CommunityPost.post_id).order_by(CommunityPost.post_id).limit(chunk_size)
+        if last_post_id is not None:
+            stmt = stmt.where(CommunityPost.post_id > last_post_id)
+        post_ids = session.scalars(stmt).all()
+        yield from post_ids
+        if len(post_ids) < chunk_size:
+            return
+        last_post_id = post_ids[-1]
 
 def get_existing_posts():
-    return set(session.scalars(select(CommunityPost.post_id)))
+    """
+    Index of the stored post_ids for --skip-existing, see postids.PostIdIndex.
+    """
+    return PostIdIndex.build(iter_post_ids())
+
+def existing_post_ids(post_ids):
+    """
+    The subset of post_ids stored in the database, checked with chunked IN queries.
+    Compared exactly in Python, the column collation may be case-insensitive.
+    """
+    post_ids = list(post_ids)
+    found = set()
+    for start in range(0, len(post_ids), CONFIRM_CHUNK):
+        chunk = post_ids[start:start + CONFIRM_CHUNK]
+        found.update(session.scalars(select(CommunityPost.post_id).where(CommunityPost.post_id.in_(chunk))))
+    return found.intersection(post_ids)
 
 # --- 4. Retrieval Logic (Recreating the Data Structures) ---
 
@@ -0,0 +1,204 @@
+"""
+Static export: renders the archive to plain files with the app's own routes and
+templates, so a web server can serve it without the Flask/gunicorn tier.
+
+Layout of OUT_DIR:
+    index.html
+    channel/<channel_id>.html
+    channel/<channel_id>/page/<n>.html
+    post/<post_id>.html
+    rss/rss.xml
+    assets/<fingerprinted name>, style.css, script.js
+
+nginx example (the /files attachments are served from post_root as before):
+    location / { try_files $uri $uri.html $uri/index.html =404; gzip_static on; }
+    location /assets/ { gzip_static on; add_header Cache-Control "public, max-age=31536000, immutable"; }
+
+Exports are incremental: only channels whose channel_summary.updated_at changed
+since the last export are re-rendered, tracked in OUT_DIR/.export-state.json.
+Each of those channels is read once, page by page with the keyset cursors, and after
+an ingest only the post pages of the posts it changed are re-rendered.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from sqlalchemy import select
+
+STATE_FILE = '.export-state.json'
+# Posts per channel page, the app's default page size
+PAGE_SIZE = 20
+
+
+def write_file(out_dir, relative_path, data, precompress=False):
+    """
+    Writes data to out_dir/relative_path atomically, plus .gz/.br siblings if precompress is set.
+    Siblings that aren't rewritten are removed, gzip_static/brotli_static would serve them stale.
+    """
+    path = os.path.join(out_dir, *relative_path.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    variants = [(path, data)]
+    if precompress:
+        variants.append((path + '.gz', gzip.compress(data, compresslevel=9, mtime=0)))
+        if brotli is not None:
+            variants.append((path + '.br', brotli.compress(data)))
+    for target, content in variants:
+        temp = target + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(content)
+        os.replace(temp, target)
+    written = {target for target, _ in variants}
+    for target in (path + '.gz', path + '.br'):
+        if target not in written and os.path.exists(target):
+            os.remove(target)
+
+
+def remove_file(out_dir, relative_path):
+    path = os.path.join(out_dir, *relative_path.split('/'))
+    for target in (path, path + '.gz', path + '.br'):
+        if os.path.exists(target):
+            os.remove(target)
+
+
+def load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(out_dir, state):
+    with open(os.path.join(out_dir, STATE_FILE + '.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(os.path.join(out_dir, STATE_FILE + '.tmp'), os.path.join(out_dir, STATE_FILE))
+
+
+def outdated_channels(out_dir):
+    """
+    Channels changed since the last export into out_dir. Read before an ingest, these are
+    the channels whose post pages that ingest's PostChanges doesn't fully cover.
+    """
+    import database
+    exported = load_state(out_dir).get('channels', {})
+    return {row.channel_id for row in database.session.execute(
+        select(database.ChannelSummary.channel_id, database.ChannelSummary.updated_at))
+        if exported.get(row.channel_id, {}).get('updated_at') != row.updated_at.isoformat()}
+
+
+def channel_pages(web, channel_id):
+    """
+    Yields every page of a channel as a numbered PostPage, walking the channel once
+    with the keyset cursors instead of one OFFSET query per page.
+    """
+    from database import CommunityPost
+    query = web.db.session.query(CommunityPost).filter(CommunityPost.channel_id == channel_id)
+    pagination = web.paginate_posts(query, PAGE_SIZE, page=1)
+    while pagination.items:
+        yield pagination
+        if not pagination.has_next:
+            return
+        page = pagination.page + 1
+        pagination = web.paginate_posts(query, PAGE_SIZE, before=pagination.next_cursor)
+        pagination.page = page
+
+
+def export_static(out_dir, full=False, precompress=False, base_url='http://localhost/', changes=None, outdated=None):
+    """
+    Renders the index, channel pages, post pages and RSS feed into out_dir.
+    Only channels changed since the previous export are rendered unless full is set.
+    changes is the PostChanges of the ingest just run and outdated what outdated_channels
+    returned before it: channels changed by that ingest alone only get the pages of its
+    inserted and updated posts re-rendered, other changed channels all of their post pages.
+    Returns the number of channels rendered.
+    """
+    # Imported here so generate.py only needs the web app when exporting
+    import app as web
+    from database import ChannelSummary
+
+    # Export pages link differently from live ones, keep them out of the shared page cache
+    app = web.create_app({'STATIC_EXPORT': True, 'CACHE_TYPE': 'NullCache', 'CACHE_NO_NULL_WARNING': True})
+    client = app.test_client()
+
+    def render(url, relative_path):
+        response = client.get(url, base_url=base_url)
+        if response.status_code != 200:
+            logging.warning("Export of {0} returned {1}".format(url, response.status_code))
+            return False
+        write_file(out_dir, relative_path, response.get_data(), precompress=precompress)
+        return True
+
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir)
+    if state.get('templates_version') != web.TEMPLATES_VERSION:
+        # Templates changed, every page looks different
+        full = True
+    exported = {} if full else state.get('channels', {})
+
+    with app.app_context():
+        summaries = web.db.session.execute(
+            select(ChannelSummary.channel_id, ChannelSummary.updated_at)
+        ).all()
+
+        changed = [row for row in summaries if exported.get(row.channel_id, {}).get('updated_at') != row.updated_at.isoformat()]
+        logging.info("Exporting {0} of {1} channels".format(len(changed), len(summaries)))
+
+        changed_posts = changes.inserted | changes.updated if changes is not None else set()
+
+        for row in changed:
+            # Post pages are only skipped when this ingest's changes are all the channel missed
+            all_posts = changes is None or outdated is None or row.channel_id in outdated \
+                or row.channel_id not in changes.channels or row.channel_id not in exported
+            pages = 0
+            for pagination in channel_pages(web, row.channel_id):
+                pages = pagination.page
+                page_path = f"channel/{row.channel_id}" + (f"/page/{pages}" if pages > 1 else "")
+                # Rendered directly, the route would look the page up again by OFFSET
+                with app.test_request_context(f"/{page_path}", base_url=base_url):
+                    html = web.render_channel_page(row.channel_id, pagination)
+                write_file(out_dir, f"{page_path}.html", html.encode('utf-8'), precompress=precompress)
+                for post in pagination.items:
+                    if all_posts or post.post_id in changed_posts:
+                        render(f"/post/{post.post_id}", f"post/{post.post_id}.html")
+            if not pages:
+                logging.warning("Export of channel {0} found no posts".format(row.channel_id))
+            # Drop pages left over from an earlier, longer export
+            for page in range(max(pages, 1) + 1, exported.get(row.channel_id, {}).get('pages', 0) + 1):
+                remove_file(out_dir, f"channel/{row.channel_id}/page/{page}.html")
+
+            exported[row.channel_id] = {'updated_at': row.updated_at.isoformat(), 'pages': pages}
+            # Save progress so an interrupted export resumes where it stopped
+            save_state(out_dir, {'templates_version': web.TEMPLATES_VERSION, 'channels': exported})
+
+    if changed or full or not os.path.exists(os.path.join(out_dir, 'index.html')):
+        render('/', 'index.html')
+        render('/rss/rss.xml', 'rss/rss.xml')
+        for name, asset in web.static_assets.by_name.items():
+            write_file(out_dir, name, asset.data, precompress=precompress)
+            write_file(out_dir, f"assets/{asset.fingerprinted_name}", asset.data, precompress=precompress)
+
+    save_state(out_dir, {'templates_version': web.TEMPLATES_VERSION, 'channels': exported})
+    return len(changed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Static site export")
+
+    parser.add_argument('out_dir', type=str, help='Output directory')
+
+    parser.add_argument('--full', action='store_true', help="Re-render every channel, not only the ones changed since the last export")
+
+    parser.add_argument('--precompress', action='store_true', help="Also write .gz (and .br if brotli is installed) next to each file")
+
+    parser.add_argument('--base-url', type=str, default='http://localhost/', help="Public URL of the site, used for absolute links in the RSS feed")
+
+    args = parser.parse_args()
+
+    export_static(args.out_dir, full=args.full, precompress=args.precompress, base_url=args.base_url)
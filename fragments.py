@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """
+    In-process LRU of rendered HTML fragments, bounded by the total size of the
+    stored strings rather than their number.
+    If a flask-caching Cache is given as shared, misses are looked up there
+    and new fragments written to it, so workers can share their renders.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, shared=None, timeout=None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.timeout = timeout
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        """
+        Returns {key: fragment} for the keys that are cached.
+        """
+        found = {}
+        with self.lock:
+            for key in keys:
+                fragment = self.entries.get(key)
+                if fragment is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = fragment
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.shared is not None:
+            shared_found = {key: fragment for key, fragment in zip(missing, self.shared.get_many(*missing)) if fragment is not None}
+            self.store(shared_found)
+            found.update(shared_found)
+        return found
+
+    def set_many(self, fragments):
+        self.store(fragments)
+        if fragments and self.shared is not None:
+            self.shared.set_many(fragments, timeout=self.timeout)
+
+    def store(self, fragments):
+        with self.lock:
+            for key, fragment in fragments.items():
+                if len(fragment) > self.max_bytes:
+                    continue
+                previous = self.entries.pop(key, None)
+                if previous is not None:
+                    self.size -= len(previous)
+                self.entries[key] = fragment
+                self.size += len(fragment)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
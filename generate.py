@@ -1,13 +1,23 @@
 
-import glob
+import bisect
+import fnmatch
+import hashlib
 import json
 from pathlib import Path
 import database
+import metrics
+import postjson
+import thumbnails
+import blobs
+import watch
 import os
 import posixpath
 
 from pathlib import Path
 import argparse
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import logging
 
@@ -48,6 +58,63 @@ def get_relative_to_web_root(files_path, web_root):
         # Returns absolute POSIX path (e.g., C:/temp or /var/log)
         return p.as_posix()
 
+class DirectoryIndex:
+    """
+    Sorted listing of a single directory, used to answer "all files starting
+    with post_ID" without rescanning the directory for every post.
+    Names are compared with os.path.normcase so matching behaves like glob
+    on the current platform, and results keep the directory listing order.
+    """
+    def __init__(self, path):
+        self.path = path
+        try:
+            names = os.listdir(path)
+        except OSError:
+            names = []
+        self.entries = sorted((os.path.normcase(name), position, name) for position, name in enumerate(names))
+        self.keys = [entry[0] for entry in self.entries]
+
+    def with_prefix(self, prefix, pattern="*"):
+        """
+        Returns the names starting with prefix that also match the fnmatch
+        pattern, in the same order glob.glob would return them.
+        """
+        prefix = os.path.normcase(prefix)
+        start = bisect.bisect_left(self.keys, prefix)
+        matches = []
+        for key, position, name in self.entries[start:]:
+            if not key.startswith(prefix):
+                break
+            # glob does not match hidden files with a leading wildcard
+            if name.startswith('.') and not prefix.startswith('.'):
+                continue
+            if fnmatch.fnmatch(name, pattern):
+                matches.append((position, name))
+        return [os.path.join(self.path, name) for position, name in sorted(matches)]
+
+
+directory_indexes = {}
+
+def get_directory_index(path):
+    """
+    Returns the cached DirectoryIndex for path, listing the directory on first use.
+    """
+    path = str(path)
+    index = directory_indexes.get(path)
+    if index is None:
+        index = DirectoryIndex(path)
+        directory_indexes[path] = index
+    return index
+
+def invalidate_directory_index(path=None):
+    """
+    Drops the cached listing for path, or every cached listing if path is None.
+    """
+    if path is None:
+        directory_indexes.clear()
+    else:
+        directory_indexes.pop(str(path), None)
+
 def get_picture_files(path, post_ID, web_root):
     """
     Returns a list of picture files (png, jpg, jpeg, gif)
@@ -56,8 +123,9 @@ def get_picture_files(path, post_ID, web_root):
     picture_files = []
     extensions = ['png', 'jpg', 'jpeg', 'gif']
 
+    index = get_directory_index(path)
     for ext in extensions:
-        for f in glob.glob(f"{path}/{post_ID}*.{ext}"):
+        for f in index.with_prefix(post_ID, f"*.{ext}"):
             picture_files.append(get_relative_to_web_root(f, web_root))
     
     return picture_files
@@ -67,7 +135,7 @@ def get_extra_files(path, post_ID, web_root):
     Returns a list of all files matching post_ID* relative to the web root.
     """
     files = []
-    for f in glob.glob(f"{path}/{post_ID}*"):
+    for f in get_directory_index(path).with_prefix(post_ID):
         files.append(get_relative_to_web_root(f, web_root))
     return files
 
@@ -76,24 +144,50 @@ def get_json_files(path, web_root):
     Returns a list of all JSON files in a path relative to the web root.
     """
     json_files = []
-    for f in glob.glob(f"{path}/*.json"):
+    for f in get_directory_index(path).with_prefix("", "*.json"):
         json_files.append(get_relative_to_web_root(f, web_root))
     return json_files
 
 
-def process_file(file):
-    
-    post = {}
-    with open(file, 'r', encoding='utf-8') as f:
-        post = json.load(f)
-        if isinstance(post, list):
-            logging.warning("Post is list (possibly sorted list?) returning...")
-            return
-        if post.get("post_id", None) is None:
-            raise ValueError("unable to find post id, JSON is not valid")
-        
-    if existing and post.get("post_id") in existing:
-        return
+def prepare_file(file, manifest=None, check_existing=True):
+    """
+    Parses a post JSON, resolves its attachments and extracts the database rows.
+    Returns the record for database.write_post, or None if the file is skipped.
+    Runs in the ingest worker pool when --workers is used.
+
+    With the ingest manifest in use, manifest holds the file's path, size and mtime_ns
+    plus the content_hash and post_id recorded last time (None for new files).
+    Skipped files then return a manifest-only record so they are not read again,
+    and files whose content changed are re-ingested even if the post already exists.
+
+    Posts found in the existing index (--skip-existing) come back as a record with a
+    "skipped" entry, to be confirmed by confirm_skipped since the index can give false hits.
+    """
+    job_manifest = manifest
+    with open(file, 'rb') as f:
+        data = f.read()
+
+    if manifest is not None:
+        content_hash = hashlib.sha256(data).hexdigest()
+        changed = manifest["content_hash"] is not None
+        if manifest["content_hash"] == content_hash:
+            # Touched but identical, only the stat needs refreshing
+            return {"post": None, "blocks": [], "attachments": [], "manifest": manifest}
+        manifest = dict(manifest, content_hash=content_hash, post_id=None)
+
+    post = postjson.load_post(data, config.get("json_backend", "auto"))
+    if isinstance(post, list):
+        logging.warning("Post is list (possibly sorted list?) returning...")
+        return None if manifest is None else {"post": None, "blocks": [], "attachments": [], "manifest": manifest}
+    if post.get("post_id", None) is None:
+        raise ValueError("unable to find post id, JSON is not valid")
+
+    if manifest is not None:
+        manifest["post_id"] = post.get("post_id")
+
+    if check_existing and existing and post.get("post_id") in existing and not (manifest is not None and changed):
+        return {"post": None, "blocks": [], "attachments": [], "manifest": manifest,
+                "skipped": (file, job_manifest, post.get("post_id"))}
         
     json_files = [get_relative_to_web_root(file, config.get("web_root"))]
 
@@ -103,33 +197,479 @@ def process_file(file):
 
     extra_files = list(set(extra_files) - set(json_files) - set(picture_files))
 
-    database.store_post(info=post, pictures=picture_files, json_files=json_files, files=extra_files)
+    record = database.extract_post(info=post, pictures=picture_files, json_files=json_files, files=extra_files)
+    record["manifest"] = manifest
+    return record
+
+def process_file(file):
+    for record in confirm_skipped([prepare_file(file)]):
+        database.write_post(record)
+
+def confirm_skipped(records, chunk_size=database.CONFIRM_CHUNK):
+    """
+    Passes records through, holding back the ones skipped as existing until a chunk of
+    them has been checked against the database in one query. Confirmed skips keep only
+    their manifest update; files whose post turns out to be new are prepared again.
+    """
+    pending = []
+
+    def confirm():
+        found = database.existing_post_ids(post_id for _, (_, _, post_id) in pending)
+        for record, (file, manifest, post_id) in pending:
+            if post_id in found:
+                if record["manifest"] is not None:
+                    yield {"post": None, "blocks": [], "attachments": [], "manifest": record["manifest"]}
+                continue
+            try:
+                record = prepare_file(file, manifest, check_existing=False)
+            except Exception as e:
+                logging.exception("Error occurred processing json: {0} - {1}".format(file, e))
+                metrics.ingest_error('parse')
+                continue
+            if record is not None:
+                yield record
+        pending.clear()
+
+    for record in records:
+        if record is None:
+            continue
+        if "skipped" not in record:
+            yield record
+            continue
+        pending.append((record, record.pop("skipped")))
+        if len(pending) >= chunk_size:
+            yield from confirm()
+    if pending:
+        yield from confirm()
+
+def init_worker(worker_config, worker_existing):
+    """
+    Pool initializer: copies the loader state into the worker process.
+    """
+    global config, existing
+    config = worker_config
+    existing = worker_existing
+
+def drain_queue(write_queue):
+    """
+    Yields records from the queue until it receives None.
+    """
+    while True:
+        record = write_queue.get()
+        if record is None:
+            return
+        yield record
+
+def write_worker(write_queue, batch_size, result, changes=None):
+    """
+    Single database writer. Stores queued records in batches until it receives None.
+    The number of posts written is left in result["written"], what changed in changes.
+    """
+    records = drain_queue(write_queue)
+    try:
+        result["written"] = database.store_posts(confirm_skipped(records), batch_size=batch_size, changes=changes)
+    except Exception as e:
+        logging.exception("Error occurred writing posts: {0}".format(e))
+        metrics.ingest_error('write')
+        # Keep draining so the producers never block on a full queue
+        for _ in records:
+            pass
+
+def collect_results(pending, write_queue, return_when):
+    """
+    Waits on the pending futures and hands finished records to the writer.
+    Blocks on the bounded queue if the writer falls behind.
+    """
+    done, _ = wait(pending, return_when=return_when)
+    for future in done:
+        file = pending.pop(future)
+        try:
+            record = future.result()
+        except Exception as e:
+            logging.exception("Error occurred processing json: {0} - {1}".format(file, e))
+            metrics.ingest_error('parse')
+            continue
+        if record is not None:
+            write_queue.put(record)
+
+def prepare_files(jobs):
+    """
+    Yields the records for (file, manifest) jobs, logging and skipping files that fail.
+    """
+    for file, manifest in jobs:
+        try:
+            record = prepare_file(file, manifest)
+        except Exception as e:
+            logging.exception("Error occurred processing json: {0} - {1}".format(file, e))
+            metrics.ingest_error('parse')
+            continue
+        if record is not None:
+            yield record
+
+def process_files_parallel(jobs, workers, batch_size=500, changes=None):
+    """
+    Parses files in a process pool and writes the results from a single writer thread.
+    At most workers * 4 files are in flight and at most workers * 4 records wait for the writer.
+    Returns the number of posts written, collects what changed in changes (a database.PostChanges).
+    """
+    write_queue = queue.Queue(maxsize=workers * 4)
+    result = {"written": 0}
+    writer = threading.Thread(target=write_worker, args=(write_queue, batch_size, result, changes), name="db-writer")
+    writer.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(config, existing)) as pool:
+            pending = {}
+            for file, manifest in jobs:
+                pending[pool.submit(prepare_file, file, manifest)] = file
+                if len(pending) >= workers * 4:
+                    collect_results(pending, write_queue, FIRST_COMPLETED)
+            while pending:
+                collect_results(pending, write_queue, FIRST_COMPLETED)
+    finally:
+        write_queue.put(None)
+        writer.join()
+    return result["written"]
+
+def scan_json_files(root_dir):
+    """
+    Recursively yields (path, stat) for every .json file under root_dir.
+    Uses os.scandir so the stat is free on Windows and one call per file elsewhere.
+    Symlinked directories are not followed, so a symlink loop cannot hang the scan.
+    """
+    directories = [str(root_dir)]
+    while directories:
+        try:
+            entries = list(os.scandir(directories.pop()))
+        except OSError as e:
+            logging.warning("Unable to list directory: {0}".format(e))
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif fnmatch.fnmatch(entry.name, '*.json'):
+                yield entry.path, entry.stat()
+
+def manifest_job(file, stat, root_dir, entry, force=False):
+    """
+    Builds the (file, manifest) job for a file that is new or changed.
+    force discards the stored hash so the post is re-read even if its JSON is unchanged.
+    """
+    return (file, {
+        "path": Path(os.path.relpath(file, root_dir)).as_posix(),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "content_hash": entry.content_hash if entry is not None and not force else None,
+        "post_id": entry.post_id if entry is not None else None,
+    })
+
+def get_incremental_jobs(root_dir):
+    """
+    Compares the files under root_dir with the ingest manifest.
+    Returns (file, manifest) jobs for new files and files whose size or mtime changed.
+    """
+    known = database.get_manifest()
+    jobs = []
+    scanned = 0
+    for file, stat in scan_json_files(root_dir):
+        scanned += 1
+        key = Path(os.path.relpath(file, root_dir)).as_posix()
+        entry = known.get(key)
+        if entry is not None and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+            continue
+        jobs.append(manifest_job(file, stat, root_dir, entry))
+    metrics.ingest_files_scanned(scanned)
+    logging.info("Scanned {0} files, {1} new or changed".format(scanned, len(jobs)))
+    return jobs
+
+def ingest_changes(directory, names, batch_size=500, make_thumbnails=False, dedupe_attachments=False, metrics_file=None):
+    """
+    Watch mode callback: ingests the posts in directory affected by the changed file names.
+    A changed JSON is read if its content differs from the manifest; a changed attachment
+    forces its post to be re-read so the new file is recorded.
+    """
+    root_dir = Path(config.get("post_root"))
+    invalidate_directory_index(directory)
+    json_names = [os.path.basename(f) for f in get_directory_index(directory).with_prefix("", "*.json")]
+
+    targets = {}
+    for name in names:
+        for json_name in json_names:
+            if name == json_name:
+                targets.setdefault(json_name, False)
+            elif name.startswith(json_name[:-len('.json')]):
+                targets[json_name] = True
+    if not targets:
+        return
+
+    files = {Path(os.path.relpath(os.path.join(directory, name), root_dir)).as_posix(): (os.path.join(directory, name), force)
+             for name, force in targets.items()}
+    known = database.get_manifest(files.keys())
+    jobs = []
+    for key, (file, force) in files.items():
+        try:
+            stat = os.stat(file)
+        except OSError:
+            # Removed again before it settled
+            continue
+        jobs.append(manifest_job(file, stat, root_dir, known.get(key), force=force))
+
+    metrics.ingest_files_scanned(len(files))
+    logging.info("Detected {0} new or changed posts in {1}".format(len(jobs), directory))
+    changes = database.PostChanges()
+    with metrics.ingest_stage('ingest'):
+        written = database.store_posts(confirm_skipped(prepare_files(jobs)), batch_size=batch_size, changes=changes)
+    logging.info("Stored {0}".format(changes))
+    metrics.ingest_posts_written(written)
+    metrics.ingest_posts_unchanged(changes.unchanged)
+    if written and dedupe_attachments:
+        with metrics.ingest_stage('blobs'):
+            written += store_blobs(batch_size=batch_size, post_ids=changes.inserted | changes.updated)
+    if written and make_thumbnails:
+        with metrics.ingest_stage('thumbnails'):
+            written += generate_thumbnails(batch_size=batch_size, post_ids=changes.inserted | changes.updated)
+    if written:
+        database.bump_data_generation()
+    metrics.write_ingest_metrics(metrics_file)
+
+def get_path_from_web_root(web_path):
+    """
+    Inverse of get_relative_to_web_root: the filesystem path of a stored web path.
+    Paths outside web_root were stored as absolute paths and are returned as they are.
+    """
+    web_root = posixpath.normpath(config.get("web_root"))
+    relative = posixpath.relpath(posixpath.normpath(web_path), web_root)
+    if relative.startswith('..'):
+        return web_path
+    return os.path.join(config.get("post_root"), *relative.split('/'))
+
+def variant_rows(post_id, file_path, variants):
+    """
+    attachment_variants rows for one image, variants is None if it couldn't be read or resized.
+    """
+    if not variants:
+        # Marker row, the image needs no copies or failed (see AttachmentVariant)
+        return [{"post_id": post_id, "file_path": file_path, "variant_path": file_path, "width": 0, "height": 0,
+                 "format": database.THUMBNAIL_FAILED if variants is None else ""}]
+    return [{"post_id": post_id, "file_path": file_path,
+             "variant_path": get_relative_to_web_root(path, config.get("web_root")),
+             "width": width, "height": height, "format": fmt}
+            for path, width, height, fmt in variants]
+
+def generate_thumbnails(workers=1, refresh=False, batch_size=500, post_ids=None, changes=None):
+    """
+    Writes resized copies of IMAGE attachments and records them in attachment_variants.
+    Only images without variants are read unless refresh is set, in which case every image
+    is checked and copies older than their original are redone. Images that can't be read are
+    recorded as failed and only retried by a refresh.
+    post_ids limits the pass to those posts' images, changes (a PostChanges) collects the posts given variants.
+    Returns the number of variants stored.
+    """
+    post_root = config.get("post_root")
+    thumbnail_root = config.get("thumbnail_root") or os.path.join(post_root, "_thumbnails")
+    widths = config.get("thumbnail_widths", thumbnails.DEFAULT_WIDTHS)
+    formats = config.get("thumbnail_formats", thumbnails.DEFAULT_FORMATS)
+
+    images = database.get_images_for_thumbnails(all_images=refresh, post_ids=post_ids)
+    logging.info("Generating thumbnails for {0} images".format(len(images)))
+
+    stored = 0
+    rows = []
+    def add_result(post_id, file_path, variants):
+        nonlocal stored, rows
+        rows += variant_rows(post_id, file_path, variants)
+        if len(rows) >= batch_size:
+            stored += database.store_variants(rows, changes=changes)
+            rows = []
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for post_id, file_path in images:
+                future = executor.submit(thumbnails.make_variants, get_path_from_web_root(file_path),
+                                         post_root, thumbnail_root, widths, formats)
+                pending[future] = (post_id, file_path)
+                # Bound the number of queued images
+                if len(pending) >= workers * 4:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect_thumbnail(future, pending.pop(future), add_result)
+            for future in list(pending):
+                collect_thumbnail(future, pending.pop(future), add_result)
+    else:
+        for post_id, file_path in images:
+            try:
+                variants = thumbnails.make_variants(get_path_from_web_root(file_path), post_root, thumbnail_root, widths, formats)
+            except Exception as e:
+                logging.warning("Could not create thumbnails for {0} - {1}".format(file_path, e))
+                metrics.ingest_error('thumbnails')
+                variants = None
+            add_result(post_id, file_path, variants)
+
+    stored += database.store_variants(rows, changes=changes)
+    return stored
+
+def collect_thumbnail(future, image, add_result):
+    post_id, file_path = image
+    try:
+        variants = future.result()
+    except Exception as e:
+        logging.warning("Could not create thumbnails for {0} - {1}".format(file_path, e))
+        metrics.ingest_error('thumbnails')
+        variants = None
+    add_result(post_id, file_path, variants)
+
+def store_blobs(workers=1, batch_size=500, post_ids=None):
+    """
+    Adds IMAGE and FILE attachments to the content-addressed store (post_root/_blobs, which the
+    app serves from its files directory) as read-only blobs and records their hashes, so pages can
+    link to immutable /blob/ URLs. Attachments that can't be stored are recorded as failed and
+    not retried until their post's attachments change.
+    Duplicates are hardlinked to one blob unless blob_link_duplicates is false in the config,
+    which stores copies and leaves the originals alone, see blobs.store_blob.
+    post_ids limits the pass to those posts' attachments.
+    Returns the number of hashes stored.
+    """
+    blob_root = os.path.join(config.get("post_root"), blobs.STORE_DIR)
+    link_duplicates = config.get("blob_link_duplicates", True)
+
+    attachments = database.get_unhashed_attachments(post_ids=post_ids)
+    logging.info("Hashing {0} attachments into {1}".format(len(attachments), blob_root))
+
+    stored = 0
+    saved = 0
+    failed = 0
+    rows = []
+    def add_result(attachment, result):
+        nonlocal stored, saved, failed, rows
+        attachment_id, post_id, file_path = attachment
+        content_hash, bytes_saved = result
+        saved += bytes_saved
+        failed += content_hash == database.BLOB_FAILED
+        rows.append({"id": attachment_id, "post_id": post_id, "content_hash": content_hash})
+        if len(rows) >= batch_size:
+            stored += database.store_attachment_hashes(rows)
+            rows = []
 
-def main(config_file="", ignore_existing=False):
+    def collect(future, attachment):
+        try:
+            result = future.result()
+        except Exception as e:
+            logging.warning("Could not store {0} in the blob store - {1}".format(attachment[2], e))
+            metrics.ingest_error('blobs')
+            result = (database.BLOB_FAILED, 0)
+        add_result(attachment, result)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for attachment in attachments:
+                future = executor.submit(blobs.store_blob, get_path_from_web_root(attachment[2]), blob_root, link_duplicates)
+                pending[future] = attachment
+                # Bound the number of queued files
+                if len(pending) >= workers * 4:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, pending.pop(future))
+            for future in list(pending):
+                collect(future, pending.pop(future))
+    else:
+        for attachment in attachments:
+            try:
+                result = blobs.store_blob(get_path_from_web_root(attachment[2]), blob_root, link_duplicates)
+            except Exception as e:
+                logging.warning("Could not store {0} in the blob store - {1}".format(attachment[2], e))
+                metrics.ingest_error('blobs')
+                result = (database.BLOB_FAILED, 0)
+            add_result(attachment, result)
+
+    stored += database.store_attachment_hashes(rows)
+    logging.info("Stored {0} attachment hashes ({1} failed), {2} bytes freed by hardlinking duplicates".format(stored, failed, saved))
+    return stored
+
+def main(config_file="", ignore_existing=False, workers=1, batch_size=500, incremental=False,
+         watch_mode=False, settle=5.0, poll_interval=2.0, force_polling=False, rebuild_summary=False,
+         export_dir=None, export_full=False, precompress=False, base_url='http://localhost/',
+         make_thumbnails=False, refresh_thumbnails=False, rebuild_search=False, metrics_file=None,
+         json_backend=None, dedupe_attachments=False):
     if not config_file:
         raise ValueError("No config file specified")
-    global config
+    global config, existing
     with open(config_file, 'r', encoding="utf-8") as f:
         config = json.load(f)
+    if json_backend:
+        config["json_backend"] = json_backend
+    # Fail early if the configured parser isn't installed
+    postjson.resolve_backend(config.get("json_backend", "auto"))
 
     # Create SQL tables if they don't exist
-    database.Base.metadata.create_all(database.engine)
+    database.init_db()
+
+    with metrics.ingest_stage('rebuild'):
+        if rebuild_summary or database.channel_summary_missing():
+            database.rebuild_channel_summaries()
+        if rebuild_search or database.search_index_missing():
+            database.rebuild_search_index()
     # Set the root directory
     root_dir = Path(config.get("post_root"))
 
-    # Recursively find all .json files
-    json_files = list(root_dir.rglob('*.json'))
+    with metrics.ingest_stage('scan'):
+        if incremental or watch_mode:
+            # Only files that are new or changed since the last run
+            jobs = get_incremental_jobs(root_dir)
+        else:
+            # Recursively find all .json files
+            jobs = [(file, None) for file in root_dir.rglob('*.json')]
+            metrics.ingest_files_scanned(len(jobs))
 
     if ignore_existing:
-        global existing
         existing = database.get_existing_posts()
 
-    logging.info("Found {0} posts".format(len(json_files)))
-    for file in json_files:
-        try:
-            process_file(file)
-        except Exception as e:
-            logging.exception("Error occurred processing json: {0} - {1}".format(file, e))
+    logging.info("Found {0} posts".format(len(jobs)))
+    if export_dir:
+        # Imported here so plain ingest runs don't need the web app
+        import export
+        # Channels the last export is already behind on, before this run changes anything
+        outdated = export.outdated_channels(export_dir)
+    changes = database.PostChanges()
+    with metrics.ingest_stage('ingest'):
+        if workers > 1:
+            written = process_files_parallel(jobs, workers, batch_size=batch_size, changes=changes)
+        else:
+            written = database.store_posts(confirm_skipped(prepare_files(jobs)), batch_size=batch_size, changes=changes)
+    # Only the channels listed here got a new updated_at, cached pages of the others stay valid
+    logging.info("Stored {0}".format(changes))
+    if changes.channels:
+        logging.debug("Changed channels: {0}".format(", ".join(sorted(changes.channels))))
+    metrics.ingest_posts_written(written)
+    metrics.ingest_posts_unchanged(changes.unchanged)
+
+    if dedupe_attachments:
+        with metrics.ingest_stage('blobs'):
+            written += store_blobs(workers=workers, batch_size=batch_size)
+
+    if make_thumbnails or refresh_thumbnails:
+        with metrics.ingest_stage('thumbnails'):
+            written += generate_thumbnails(workers=workers, refresh=refresh_thumbnails, batch_size=batch_size, changes=changes)
+
+    if written or rebuild_summary or rebuild_search:
+        # Invalidate the web app's cached pages
+        database.bump_data_generation()
+
+    if export_dir:
+        with metrics.ingest_stage('export'):
+            export.export_static(export_dir, full=export_full, precompress=precompress, base_url=base_url,
+                                 changes=changes, outdated=outdated)
+
+    metrics.write_ingest_metrics(metrics_file)
+
+    if watch_mode:
+        # Changed files are compared against the manifest, not the startup snapshot
+        existing = set()
+        watch.watch_posts(root_dir, lambda directory, names: ingest_changes(directory, names, batch_size=batch_size,
+                                                                           make_thumbnails=make_thumbnails or refresh_thumbnails,
+                                                                           dedupe_attachments=dedupe_attachments,
+                                                                           metrics_file=metrics_file),
+                          settle=settle, poll_interval=poll_interval, force_polling=force_polling)
 
 if __name__ == "__main__":
     # Create the parser
@@ -138,8 +678,49 @@ if __name__ == "__main__":
     parser.add_argument('config', type=str, default="config.json", help='Config File Location')
 
     parser.add_argument('--skip-existing', action='store_true', help="Skip posts existing in database")
+
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes used to parse post files (default: 1, no pool)")
+
+    parser.add_argument('--batch-size', type=int, default=500, help="Posts written per database transaction (default: 500)")
+
+    parser.add_argument('--incremental', action='store_true', help="Only read files that are new or changed since the last run, using the ingest manifest")
+
+    parser.add_argument('--watch', action='store_true', help="Keep running and ingest new or changed posts as they appear (implies --incremental)")
+
+    parser.add_argument('--settle', type=float, default=5.0, help="Seconds a directory must be unchanged before its posts are ingested in --watch mode (default: 5)")
+
+    parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds between scans when polling in --watch mode (default: 2)")
+
+    parser.add_argument('--poll', action='store_true', help="Poll for changes instead of using filesystem events, e.g. on network mounts")
+
+    parser.add_argument('--rebuild-summary', action='store_true', help="Rebuild the per-channel summary table used by the home page")
+
+    parser.add_argument('--rebuild-search', action='store_true', help="Rebuild the full-text search index from the stored posts")
+
+    parser.add_argument('--export-static', type=str, default=None, metavar='OUT_DIR', help="After ingest, render the site to static files in OUT_DIR (only changed channels)")
+
+    parser.add_argument('--export-full', action='store_true', help="Re-render every channel in --export-static")
+
+    parser.add_argument('--precompress', action='store_true', help="Write .gz/.br copies of exported files")
+
+    parser.add_argument('--base-url', type=str, default='http://localhost/', help="Public URL of the site for absolute links in exported RSS")
+
+    parser.add_argument('--json-backend', choices=postjson.BACKENDS, default=None, help="Post JSON parser: auto (orjson if installed), json, orjson, or ijson to only build the fields that are stored (default: json_backend from the config, else auto)")
+
+    parser.add_argument('--metrics-file', type=str, default=None, help="Write ingest counters and stage timings here in Prometheus text format (node_exporter textfile collector), needs prometheus_client")
+
+    parser.add_argument('--thumbnails', action='store_true', help="Create resized WebP/JPEG copies of images that don't have them yet (needs Pillow)")
+
+    parser.add_argument('--refresh-thumbnails', action='store_true', help="Check every image and redo thumbnails older than their original")
+
+    parser.add_argument('--dedupe-attachments', action='store_true', help="Store image and file attachments once in the content-addressed store (post_root/_blobs), hardlinking duplicates, so pages use immutable /blob/ URLs; set blob_link_duplicates to false in the config to store read-only copies instead")
     
     # Parse the arguments
     args = parser.parse_args()
 
-    main(config_file=args.config, ignore_existing=args.skip_existing)
\ No newline at end of file
+    main(config_file=args.config, ignore_existing=args.skip_existing, workers=args.workers, batch_size=args.batch_size, incremental=args.incremental,
+         watch_mode=args.watch, settle=args.settle, poll_interval=args.poll_interval, force_polling=args.poll,
+         rebuild_summary=args.rebuild_summary, export_dir=args.export_static, export_full=args.export_full,
+         precompress=args.precompress, base_url=args.base_url,
+         make_thumbnails=args.thumbnails, refresh_thumbnails=args.refresh_thumbnails, rebuild_search=args.rebuild_search,
+         metrics_file=args.metrics_file, json_backend=args.json_backend, dedupe_attachments=args.dedupe_attachments)
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+gunicorn settings shared by run.sh; worker count, bind address etc. stay on its command line.
+"""
+import os
+import shutil
+import tempfile
+
+# Each worker writes its metrics here and /metrics aggregates them, see metrics.py.
+# Must be set before the workers import prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'community_tab_display_metrics'))
+# Created here, not in on_starting: with preload_app the master imports the app, and
+# prometheus_client opens its sample files in this directory, before on_starting runs
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Create the app once in the master and fork it, instead of importing it in every worker
+# (and again whenever --max-requests recycles one). GUNICORN_PRELOAD=0 turns it off.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to this one's.
+    # Keep the master's own files (counter_<pid>.db, ...), already open if the app was preloaded.
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    own = f"_{os.getpid()}.db"
+    for name in os.listdir(path):
+        if not name.endswith(own):
+            target = os.path.join(path, name)
+            if os.path.isdir(target):
+                shutil.rmtree(target, ignore_errors=True)
+            else:
+                os.remove(target)
+
+
+def post_fork(server, worker):
+    # The preloaded app's connection pool was created in the master, start each worker with an empty one
+    if server.cfg.preload_app:
+        import app
+        app.after_fork(worker.app.wsgi())
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
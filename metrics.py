@@ -0,0 +1,224 @@
+"""
+Prometheus metrics for the web app and the ingest script.
+
+Web metrics are recorded per request by init_app and served on /metrics.
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py does) so every
+worker writes its samples there and /metrics aggregates all of them.
+
+Ingest metrics live in their own registry and are written in the node_exporter
+textfile format by write_ingest_metrics, since generate.py is not a server.
+
+Everything is a no-op if prometheus_client is not installed.
+"""
+import contextlib
+import os
+import time
+
+from flask import g, request, Response, abort, before_render_template, template_rendered
+
+try:
+    from prometheus_client import (
+        Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST,
+        generate_latest, multiprocess, write_to_textfile
+    )
+except ImportError:
+    Counter = None
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, float('inf'))
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100, float('inf'))
+
+if Counter is not None:
+    REQUEST_SECONDS = Histogram(
+        'http_request_duration_seconds', 'Time to build the response (excludes streaming)',
+        ['endpoint', 'method', 'status'])
+    REQUEST_SQL_QUERIES = Histogram(
+        'http_request_sql_queries', 'SQL statements executed per request',
+        ['endpoint'], buckets=QUERY_BUCKETS)
+    REQUEST_SQL_SECONDS = Histogram(
+        'http_request_sql_seconds', 'Time spent in SQL statements per request',
+        ['endpoint'])
+    RESPONSE_BYTES = Histogram(
+        'http_response_bytes', 'Response body size, before and after Flask-Compress',
+        ['endpoint', 'stage'], buckets=SIZE_BUCKETS)
+    TEMPLATE_SECONDS = Histogram(
+        'template_render_seconds', 'Template and post fragment render time',
+        ['template'])
+    CACHE_REQUESTS = Counter(
+        'cache_requests_total', 'Cache lookups by cache and result',
+        ['cache', 'result'])
+
+    # Ingest, written to a textfile by generate.py
+    ingest_registry = CollectorRegistry()
+    INGEST_FILES_SCANNED = Counter(
+        'ingest_files_scanned_total', 'Post JSON files looked at', registry=ingest_registry)
+    INGEST_POSTS_WRITTEN = Counter(
+        'ingest_posts_written_total', 'Posts inserted or updated in the database', registry=ingest_registry)
+    INGEST_POSTS_UNCHANGED = Counter(
+        'ingest_posts_unchanged_total', 'Stored posts read again and found unchanged', registry=ingest_registry)
+    INGEST_ERRORS = Counter(
+        'ingest_errors_total', 'Files or posts that failed', ['stage'], registry=ingest_registry)
+    INGEST_STAGE_SECONDS = Counter(
+        'ingest_stage_seconds_total', 'Time spent per ingest stage', ['stage'], registry=ingest_registry)
+
+
+# --- Web app ---
+
+def record_cache(cache, hits, misses):
+    if Counter is None:
+        return
+    if hits:
+        CACHE_REQUESTS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, 'miss').inc(misses)
+
+
+def record_render(template, seconds):
+    if Counter is not None:
+        TEMPLATE_SECONDS.labels(template).observe(seconds)
+
+
+class InstrumentedCacheBackend:
+    """
+    Wraps a flask-caching backend to count hits and misses of get/get_many,
+    labelled with the first segment of the key (view, feed, post, rss, ...).
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def get(self, key, *args, **kwargs):
+        value = self.backend.get(key, *args, **kwargs)
+        hit = value is not None
+        record_cache(key.split('/', 1)[0], int(hit), int(not hit))
+        return value
+
+    def get_many(self, *keys):
+        values = self.backend.get_many(*keys)
+        for key, value in zip(keys, values):
+            hit = value is not None
+            record_cache(key.split('/', 1)[0], int(hit), int(not hit))
+        return values
+
+
+def instrument_cache(app, cache):
+    """
+    Counts hits and misses of a flask-caching Cache already set up on app.
+    """
+    if Counter is None:
+        return
+    backends = app.extensions['cache']
+    if not isinstance(backends[cache], InstrumentedCacheBackend):
+        backends[cache] = InstrumentedCacheBackend(backends[cache])
+
+
+def response_size(response):
+    if response.direct_passthrough or response.is_streamed:
+        return response.content_length
+    return response.calculate_content_length()
+
+
+def init_app(app):
+    """
+    Records request metrics on app and adds the /metrics route.
+    Call after Compress(app): the size before compression is taken by an after_request
+    hook that runs before Flask-Compress, everything else by one that runs after it.
+    """
+    if Counter is None:
+        return
+
+    def endpoint():
+        return request.endpoint or 'unmatched'
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_uncompressed_size(response):
+        size = response_size(response)
+        if size is not None:
+            RESPONSE_BYTES.labels(endpoint(), 'uncompressed').observe(size)
+        return response
+
+    def record_request(response):
+        started = g.get('request_started')
+        if started is None or request.endpoint == 'metrics':
+            return response
+        name = endpoint()
+        REQUEST_SECONDS.labels(name, request.method, str(response.status_code)).observe(time.perf_counter() - started)
+        REQUEST_SQL_QUERIES.labels(name).observe(g.get('sql_queries', 0))
+        REQUEST_SQL_SECONDS.labels(name).observe(g.get('sql_seconds', 0.0))
+        size = response_size(response)
+        if size is not None:
+            RESPONSE_BYTES.labels(name, 'sent').observe(size)
+        return response
+
+    def start_template_timer(sender, template, context, **extra):
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+    def record_template(sender, template, context, **extra):
+        started = g.get('template_started')
+        if started:
+            record_render(template.name, time.perf_counter() - started.pop())
+
+    before_render_template.connect(start_template_timer, app, weak=False)
+    template_rendered.connect(record_template, app, weak=False)
+
+    # after_request hooks run in reverse order of registration, this one runs last
+    app.after_request_funcs.setdefault(None, []).insert(0, record_request)
+
+    @app.route('/metrics')
+    def metrics():
+        if os.environ.get('METRICS_DISABLED'):
+            abort(404)
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+# --- Ingest ---
+
+def ingest_files_scanned(count):
+    if Counter is not None:
+        INGEST_FILES_SCANNED.inc(count)
+
+
+def ingest_posts_written(count):
+    if Counter is not None:
+        INGEST_POSTS_WRITTEN.inc(count)
+
+
+def ingest_posts_unchanged(count):
+    if Counter is not None:
+        INGEST_POSTS_UNCHANGED.inc(count)
+
+
+def ingest_error(stage):
+    if Counter is not None:
+        INGEST_ERRORS.labels(stage).inc()
+
+
+@contextlib.contextmanager
+def ingest_stage(stage):
+    """
+    Adds the time spent in the block to ingest_stage_seconds_total{stage=...}.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if Counter is not None:
+            INGEST_STAGE_SECONDS.labels(stage).inc(time.perf_counter() - started)
+
+
+def write_ingest_metrics(path):
+    """
+    Writes the ingest counters to path for node_exporter's textfile collector.
+    """
+    if Counter is not None and path:
+        write_to_textfile(path, ingest_registry)
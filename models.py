@@ -0,0 +1,320 @@
+"""
+Table definitions, shared by generate.py (through database.py) and the web app.
+Importing this module has no side effects: no engine, connection or schema work,
+that is database.init_db / `flask --app app init-db`.
+"""
+from sqlalchemy import (
+    Column, String, Text, Integer, BigInteger, Boolean, DateTime, ForeignKey, Index, inspect, event, text, DDL
+)
+from sqlalchemy.orm import relationship
+from sqlalchemy.ext.declarative import declarative_base
+import logging
+
+Base = declarative_base()
+
+# --- 2. Define Models ---
+
+class CommunityPost(Base):
+    __tablename__ = 'community_posts'
+
+    post_id = Column(String(50), primary_key=True)
+    channel_id = Column(String(24), nullable=False)
+    channel_name = Column(Text, nullable=True)
+    profile_pic_url = Column(Text, nullable=True)
+    timestamp = Column(DateTime, nullable=False)
+    likes_count = Column(Integer, default=0)
+    is_members_only = Column(Boolean, default=False)
+
+    __table_args__ = (
+        Index('Date_index', 'post_id', 'timestamp'),
+        Index('timestamp', 'timestamp'),
+        # Channel pages: WHERE channel_id = ? ORDER BY timestamp DESC, post_id DESC
+        Index('channel_timestamp', 'channel_id', 'timestamp', 'post_id'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+            'mysql_collate': 'utf8mb4_unicode_ci'
+        }
+    )
+
+    content_blocks = relationship(
+        "PostContentBlock",
+        back_populates="post",
+        order_by="PostContentBlock.id",
+        cascade="all, delete-orphan"
+    )
+    attachments = relationship(
+        "PostAttachment",
+        back_populates="post",
+        order_by="PostAttachment.id",
+        cascade="all, delete-orphan"
+    )
+    variants = relationship(
+        "AttachmentVariant",
+        back_populates="post",
+        order_by="AttachmentVariant.id",
+        cascade="all, delete-orphan"
+    )
+
+
+class PostAttachment(Base):
+    __tablename__ = 'post_attachments'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    post_id = Column(String(50), ForeignKey('community_posts.post_id'), nullable=False, index=True)
+    file_type = Column(String(10), nullable=True)
+    file_path = Column(Text, nullable=False)
+    # sha256 of the file, set by generate.py --dedupe-attachments; served from /blob/<hash>
+    content_hash = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        # FIX: Changed UniqueConstraint to Index with unique=True
+        Index(
+            'unique_post_file', 
+            'post_id', 'file_path', 
+            unique=True, 
+            mysql_using='hash'
+        ),
+        Index('attachment_post_id_sequence', 'post_id', 'id'),
+        Index('attachment_content_hash', 'content_hash'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+            'mysql_collate': 'utf8mb4_unicode_ci'
+        }
+    )
+
+    post = relationship("CommunityPost", back_populates="attachments")
+
+
+class PostContentBlock(Base):
+    __tablename__ = 'post_content_blocks'
+
+    # Matching: `id` int(11) NOT NULL AUTO_INCREMENT
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    
+    # Matching text fields: DEFAULT NULL
+    text_content = Column(Text, nullable=True)
+    link_url = Column(Text, nullable=True)
+    
+    # Matching: `post_id` varchar(50) DEFAULT NULL
+    post_id = Column(
+        String(50), 
+        ForeignKey(
+            'community_posts.post_id', 
+            name='post_id', 
+            ondelete='NO ACTION', 
+            onupdate='NO ACTION'
+        ),
+        nullable=True
+    )
+    
+    # Matching: `block_index` int(11) NOT NULL DEFAULT 0
+    block_index = Column(Integer, nullable=False, server_default='0')
+
+    __table_args__ = (
+        # Matching: UNIQUE KEY `unique_content_per_post` (`post_id`,`text_content`,`link_url`,`block_index`) USING HASH
+        Index(
+            'unique_content_per_post', 
+            'post_id', 'text_content', 'link_url', 'block_index', 
+            unique=True, 
+            mysql_using='hash'
+        ),
+        
+        Index('post_id_idx', 'post_id'),
+        Index('id_post_id', 'id', 'post_id'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+        }
+    )
+
+    post = relationship("CommunityPost", back_populates="content_blocks")
+
+class AttachmentVariant(Base):
+    """
+    Resized copy of an IMAGE attachment, written by generate.py --thumbnails.
+    file_path is the original's path as stored in post_attachments.
+    A row with variant_path == file_path marks an image that gets no copies (animated,
+    or narrower than the smallest width), or with format 'failed' one that couldn't be
+    read or resized, so later runs don't open it again.
+    """
+    __tablename__ = 'attachment_variants'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    post_id = Column(String(50), ForeignKey('community_posts.post_id'), nullable=False)
+    file_path = Column(Text, nullable=False)
+    variant_path = Column(Text, nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    format = Column(String(10), nullable=False)
+
+    __table_args__ = (
+        Index(
+            'unique_post_variant',
+            'post_id', 'variant_path',
+            unique=True,
+            mysql_using='hash'
+        ),
+        Index('variant_post_id_sequence', 'post_id', 'id'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+            'mysql_collate': 'utf8mb4_unicode_ci'
+        }
+    )
+
+    post = relationship("CommunityPost", back_populates="variants")
+
+
+class PostSearch(Base):
+    """
+    Searchable text of each post (its content blocks joined), written by the ingest path.
+    Indexed with FULLTEXT on MariaDB/MySQL and mirrored into an FTS5 table on SQLite,
+    see the DDL below.
+    """
+    __tablename__ = 'post_search'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    post_id = Column(String(50), ForeignKey('community_posts.post_id'), nullable=False)
+    channel_id = Column(String(24), nullable=False)
+    body = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index('unique_search_post', 'post_id', unique=True),
+        Index('search_channel_id', 'channel_id'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+            'mysql_collate': 'utf8mb4_unicode_ci'
+        }
+    )
+
+# Full-text index DDL, run once when post_search is created.
+# SQLite keeps an external-content FTS5 table in sync with post_search through triggers.
+SEARCH_FTS_TABLE = 'post_search_fts'
+SEARCH_DDL = {
+    ('mysql', 'mariadb'): [
+        "CREATE FULLTEXT INDEX search_body_fulltext ON post_search (body)",
+    ],
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_FTS_TABLE} USING fts5("
+        "body, content='post_search', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS post_search_ai AFTER INSERT ON post_search BEGIN "
+        f"INSERT INTO {SEARCH_FTS_TABLE}(rowid, body) VALUES (new.id, new.body); END",
+        f"CREATE TRIGGER IF NOT EXISTS post_search_ad AFTER DELETE ON post_search BEGIN "
+        f"INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}, rowid, body) VALUES ('delete', old.id, old.body); END",
+        f"CREATE TRIGGER IF NOT EXISTS post_search_au AFTER UPDATE ON post_search BEGIN "
+        f"INSERT INTO {SEARCH_FTS_TABLE}({SEARCH_FTS_TABLE}, rowid, body) VALUES ('delete', old.id, old.body); "
+        f"INSERT INTO {SEARCH_FTS_TABLE}(rowid, body) VALUES (new.id, new.body); END",
+    ],
+}
+for dialects, statements in SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(PostSearch.__table__, 'after_create', DDL(statement).execute_if(dialect=dialects))
+
+
+class IngestManifest(Base):
+    """
+    One row per post JSON file seen by generate.py, used to skip unchanged files on re-runs.
+    path is relative to post_root so the archive can be moved or remounted.
+    """
+    __tablename__ = 'ingest_manifest'
+
+    path = Column(String(768), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    # NULL for files that are not posts (e.g. sorted lists)
+    post_id = Column(String(50), nullable=True)
+
+    __table_args__ = (
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+            # Paths are case sensitive
+            'mysql_collate': 'utf8mb4_bin'
+        },
+    )
+
+class ChannelSummary(Base):
+    """
+    One row per channel for the home page, kept up to date by the ingest path
+    so the index doesn't aggregate over every post.
+    Name and profile picture are taken from the channel's latest post.
+    """
+    __tablename__ = 'channel_summary'
+
+    channel_id = Column(String(24), primary_key=True)
+    channel_name = Column(Text, nullable=True)
+    profile_pic_url = Column(Text, nullable=True)
+    latest_timestamp = Column(DateTime, nullable=False)
+    post_count = Column(Integer, nullable=False, default=0)
+    # Last time the ingest path touched this channel
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('summary_latest_timestamp', 'latest_timestamp'),
+        Index('summary_updated_at', 'updated_at'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+            'mysql_collate': 'utf8mb4_unicode_ci'
+        }
+    )
+
+class AppState(Base):
+    """
+    Small name -> counter store shared by generate.py and the web workers.
+    'data_generation' is bumped after every ingest that wrote posts, the app
+    includes it in its cache keys so new posts show up without waiting for a TTL.
+    """
+    __tablename__ = 'app_state'
+
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+            'mysql_collate': 'utf8mb4_unicode_ci'
+        },
+    )
+
+DATA_GENERATION = 'data_generation'
+
+def create_missing_columns(bind):
+    """
+    create_all doesn't alter existing tables, so add columns introduced after a table
+    was first created. Only for nullable columns without a server default.
+    """
+    inspector = inspect(bind)
+    preparer = bind.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                logging.info(f"Adding column {column.name} to {table.name}")
+                with bind.begin() as connection:
+                    connection.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                        f"{preparer.format_column(column)} {column.type.compile(dialect=bind.dialect)}"
+                    ))
+
+def create_missing_indexes(bind):
+    """
+    create_all only creates indexes together with new tables,
+    so add indexes introduced after a table was first created.
+    """
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logging.info(f"Creating index {index.name} on {table.name}")
+                index.create(bind)
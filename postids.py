@@ -0,0 +1,52 @@
+import hashlib
+import heapq
+from array import array
+from bisect import bisect_left
+
+
+def post_id_hash(post_id):
+    """
+    Stable 64-bit hash of a post_id (the builtin hash() differs between processes).
+    """
+    return int.from_bytes(hashlib.blake2b(post_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class PostIdIndex:
+    """
+    Compact set of post_ids for --skip-existing: a sorted array of 64-bit hashes,
+    8 bytes per post where a set of str costs well over 100.
+    A miss is exact. A hit can be a hash collision, so hits are confirmed against
+    the database (database.existing_post_ids) before a post is skipped for good.
+    """
+    def __init__(self, hashes=None):
+        self.hashes = hashes if hashes is not None else array('Q')
+
+    @classmethod
+    def build(cls, post_ids, chunk_size=100000):
+        """
+        Builds the index from any iterable of post_ids, e.g. a streamed query.
+        Hashes are sorted a chunk at a time and merged, so only one chunk is ever held as Python ints.
+        """
+        chunks = []
+        chunk = []
+        for post_id in post_ids:
+            chunk.append(post_id_hash(post_id))
+            if len(chunk) >= chunk_size:
+                chunks.append(array('Q', sorted(chunk)))
+                chunk = []
+        if chunk:
+            chunks.append(array('Q', sorted(chunk)))
+        if len(chunks) == 1:
+            return cls(chunks[0])
+        hashes = array('Q')
+        for value in heapq.merge(*chunks):
+            hashes.append(value)
+        return cls(hashes)
+
+    def __contains__(self, post_id):
+        value = post_id_hash(post_id)
+        i = bisect_left(self.hashes, value)
+        return i < len(self.hashes) and self.hashes[i] == value
+
+    def __len__(self):
+        return len(self.hashes)
@@ -0,0 +1,134 @@
+"""
+Post JSON parsing for the ingest path, with pluggable backends:
+    json     the standard library
+    orjson   same result, parsed a lot faster (pip install orjson)
+    ijson    streams the document and only builds the fields database.extract_post
+             reads, skipping the rest of the payload (pip install ijson)
+    auto     orjson if installed, otherwise json
+Every backend gives extract_post the same values, see benchmarks/json_backends.py.
+"""
+import io
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+BACKENDS = ('auto', 'json', 'orjson', 'ijson')
+
+# Paths read by database.extract_post, kept whole by the ijson backend
+EXTRACTED_PATHS = {
+    'post_id',
+    'channel_id',
+    'author.authorThumbnail.thumbnails',
+    'author.authorText.runs',
+    'original_post.author.authorThumbnail.thumbnails',
+    'original_post.author.authorText.runs',
+    'vote_count.simpleText',
+    '_published.lastUpdatedTimestamp',
+    'sponsor_only_badge',
+    'content_text.runs',
+}
+# Objects on the way to those paths, kept with only the wanted keys
+ANCESTOR_PATHS = {path.rsplit('.', i)[0] for path in EXTRACTED_PATHS for i in range(1, path.count('.') + 1)}
+
+CONTAINER_START = ('start_map', 'start_array')
+CONTAINER_END = ('end_map', 'end_array')
+
+
+def build_value(events, event, value):
+    """
+    Materializes the value whose first event is (event, value).
+    """
+    if event not in CONTAINER_START:
+        return value
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    depth = 1
+    for _, event, value in events:
+        builder.event(event, value)
+        if event in CONTAINER_START:
+            depth += 1
+        elif event in CONTAINER_END:
+            depth -= 1
+            if depth == 0:
+                return builder.value
+
+
+def skip_value(events, event):
+    if event not in CONTAINER_START:
+        return
+    depth = 1
+    for _, event, _ in events:
+        if event in CONTAINER_START:
+            depth += 1
+        elif event in CONTAINER_END:
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def select_fields(events, path=''):
+    """
+    Reads the object being parsed (start_map already consumed) and returns it with only
+    the keys on EXTRACTED_PATHS, in the same shape, so chained .get() calls behave as on the full document.
+    """
+    selected = {}
+    for _, event, key in events:
+        if event == 'end_map':
+            return selected
+        child = f"{path}.{key}" if path else key
+        _, event, value = next(events)
+        if child in EXTRACTED_PATHS:
+            selected[key] = build_value(events, event, value)
+        elif child in ANCESTOR_PATHS and event == 'start_map':
+            selected[key] = select_fields(events, child)
+        elif child in ANCESTOR_PATHS:
+            selected[key] = build_value(events, event, value)
+        else:
+            skip_value(events, event)
+    return selected
+
+
+def load_selected(data):
+    events = ijson.parse(io.BytesIO(data), use_float=True)
+    _, event, value = next(events)
+    if event == 'start_map':
+        return select_fields(events)
+    # Not a post (e.g. a list file), the caller only checks the type
+    return build_value(events, event, value)
+
+
+def resolve_backend(backend='auto'):
+    """
+    The backend load_post will use for a configured name, checking the module is installed.
+    """
+    if backend in (None, 'auto'):
+        return 'orjson' if orjson is not None else 'json'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend {backend}, expected one of {', '.join(BACKENDS)}")
+    if (backend == 'orjson' and orjson is None) or (backend == 'ijson' and ijson is None):
+        raise ValueError(f"JSON backend {backend} is not installed")
+    return backend
+
+
+def load_post(data, backend='auto'):
+    """
+    Parses a post file's bytes with the given backend.
+    """
+    backend = resolve_backend(backend)
+    if backend == 'orjson':
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (e.g. NaN), keep accepting what json accepts
+            pass
+    elif backend == 'ijson':
+        return load_selected(data)
+    return json.loads(data.decode('utf-8'))
@@ -0,0 +1,5 @@
+"""
+Tests, run from the repository root:
+
+    python -m unittest discover tests
+"""
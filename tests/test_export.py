@@ -0,0 +1,78 @@
+"""
+Static export tests, run against a small synthetic archive (see benchmarks.archive).
+
+    python -m unittest tests.test_export
+"""
+import gzip
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.archive import generate_archive
+
+# Flask's send_file on Python < 3.13
+if not hasattr(mimetypes, 'guess_file_type'):
+    mimetypes.guess_file_type = mimetypes.guess_type
+
+
+class ExportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.post_root = os.path.join(cls.work_dir, 'posts')
+        cls.out_dir = os.path.join(cls.work_dir, 'out')
+        cls.channel_id = generate_archive(cls.post_root, channels=1, posts=3, images=0, files=0)[0]
+        # database.py and app.py read these at import
+        database_url = 'sqlite:///' + os.path.join(cls.work_dir, 'test.db')
+        os.environ['DATABASE_URL'] = database_url
+        os.environ['DATABASE_ADMIN_URL'] = database_url
+        cls.config_file = os.path.join(cls.work_dir, 'config.json')
+        with open(cls.config_file, 'w', encoding='utf-8') as f:
+            json.dump({"post_root": cls.post_root, "web_root": "/files"}, f)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def set_likes(self, post_id, likes):
+        path = os.path.join(self.post_root, self.channel_id, post_id + '.json')
+        with open(path, 'r', encoding='utf-8') as f:
+            post = json.load(f)
+        post["vote_count"] = {"simpleText": str(likes)}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(post, f)
+
+    def export(self, precompress):
+        import generate
+        generate.main(config_file=self.config_file, export_dir=self.out_dir, precompress=precompress)
+
+    def test_reexport_updates_compressed_siblings(self):
+        post_id = "Ugkx000000000001"
+        page = os.path.join(self.out_dir, 'post', post_id + '.html')
+
+        self.set_likes(post_id, 0)
+        self.export(precompress=True)
+        with gzip.open(page + '.gz', 'rb') as f:
+            self.assertIn(b"0 likes", f.read())
+
+        self.set_likes(post_id, 3)
+        self.export(precompress=True)
+        with open(page, 'rb') as f:
+            html = f.read()
+        self.assertIn(b"3 likes", html)
+        with gzip.open(page + '.gz', 'rb') as f:
+            self.assertEqual(f.read(), html)
+
+        self.set_likes(post_id, 5)
+        self.export(precompress=False)
+        with open(page, 'rb') as f:
+            self.assertIn(b"5 likes", f.read())
+        self.assertFalse(os.path.exists(page + '.gz'))
+        self.assertFalse(os.path.exists(page + '.br'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Default widths and formats of the resized copies
+DEFAULT_WIDTHS = [320, 640, 1280]
+DEFAULT_FORMATS = ['webp']
+
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def variant_path(source, source_root, thumbnail_root, width, fmt):
+    """
+    Path of a resized copy, mirroring the source's place under source_root inside thumbnail_root.
+    The source's extension is kept, so X.png and X.jpg next to each other get separate copies.
+    """
+    relative = os.path.relpath(source, source_root)
+    return os.path.join(thumbnail_root, f"{relative}.{width}.{fmt}")
+
+
+def is_up_to_date(target, source_mtime):
+    try:
+        return os.stat(target).st_mtime >= source_mtime
+    except OSError:
+        return False
+
+
+def make_variants(source, source_root, thumbnail_root, widths=DEFAULT_WIDTHS, formats=DEFAULT_FORMATS):
+    """
+    Writes resized copies of one image and returns [(path, width, height, format)].
+    Copies newer than the source are kept as they are. Widths at or above the original's
+    are skipped (nothing to gain), and so are animated images, which would lose their animation.
+    Runs in the generate.py worker pool.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required to generate thumbnails")
+
+    source_mtime = os.stat(source).st_mtime
+    variants = []
+    with Image.open(source) as image:
+        if getattr(image, 'is_animated', False):
+            return []
+        image = ImageOps.exif_transpose(image)
+        original_width, original_height = image.size
+
+        for width in sorted(widths):
+            if width >= original_width:
+                break
+            height = max(1, round(original_height * width / original_width))
+            resized = None
+            for fmt in formats:
+                target = variant_path(source, source_root, thumbnail_root, width, fmt)
+                if not is_up_to_date(target, source_mtime):
+                    if resized is None:
+                        resized = image.resize((width, height), Image.LANCZOS)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    converted = resized
+                    if fmt == 'jpeg' and resized.mode not in ('RGB', 'L'):
+                        converted = resized.convert('RGB')
+                    elif resized.mode == 'P':
+                        converted = resized.convert('RGBA')
+                    temp = target + '.tmp'
+                    converted.save(temp, **SAVE_OPTIONS[fmt])
+                    os.replace(temp, target)
+                variants.append((target, width, height, fmt))
+    logging.debug(f"Thumbnails for {source}: {len(variants)}")
+    return variants
@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+import logging
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class PendingChanges:
+    """
+    Collects changed file names per directory and releases a directory once
+    nothing in it has changed for `settle` seconds (or it has been pending
+    for `max_delay` seconds), so a post's attachments can finish downloading
+    before it is ingested.
+    """
+    def __init__(self, settle=5.0, max_delay=60.0):
+        self.settle = settle
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        # directory -> [first change, last change, set of names]
+        self.pending = {}
+
+    def touch(self, directory, name):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.pending.setdefault(directory, [now, now, set()])
+            entry[1] = now
+            entry[2].add(name)
+
+    def directories(self):
+        with self.lock:
+            return list(self.pending)
+
+    def pop_ready(self):
+        """
+        Returns [(directory, names)] for every directory that has settled.
+        """
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for directory, (first, last, names) in list(self.pending.items()):
+                if now - last >= self.settle or now - first >= self.max_delay:
+                    ready.append((directory, names))
+                    del self.pending[directory]
+        return ready
+
+
+class EventHandler(FileSystemEventHandler):
+    """
+    watchdog handler that feeds file events into PendingChanges.
+    Read-only events are ignored, otherwise ingesting a post would re-trigger it.
+    """
+    EVENT_TYPES = ('created', 'modified', 'moved', 'closed')
+
+    def __init__(self, changes):
+        super().__init__()
+        self.changes = changes
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in self.EVENT_TYPES:
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if path:
+                self.changes.touch(os.path.dirname(path), os.path.basename(path))
+
+
+class DirectoryPoller:
+    """
+    Polling fallback for filesystems without change notifications (e.g. network mounts).
+    Each poll stats the known directories only; a directory is listed again, and its files
+    stat'ed, when its mtime changed or it still has pending changes. Unchanged directories
+    keep the subdirectories found when they were last listed. A file counts as changed when
+    its mtime or ctime is newer than the last time its directory was listed.
+    Symlinked directories are not followed, like rglob.
+    """
+    def __init__(self, root_dir, changes):
+        self.root_dir = str(root_dir)
+        self.changes = changes
+        self.directory_mtimes = {}
+        self.subdirectories = {}
+        self.scanned_at = {}
+        # Record the current state without reporting it, the caller ingests existing files itself
+        self.walk(report=False)
+
+    def forget(self, directory):
+        self.directory_mtimes.pop(directory, None)
+        self.scanned_at.pop(directory, None)
+        for subdirectory in self.subdirectories.pop(directory, ()):
+            self.forget(subdirectory)
+
+    def walk(self, report=True):
+        pending = set(self.changes.directories())
+        directories = [self.root_dir]
+        while directories:
+            directory = directories.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self.forget(directory)
+                continue
+            if self.directory_mtimes.get(directory) == mtime and directory not in pending:
+                directories.extend(self.subdirectories.get(directory, ()))
+                continue
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            subdirectories = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+            for removed in set(self.subdirectories.get(directory, ())) - set(subdirectories):
+                self.forget(removed)
+            self.subdirectories[directory] = subdirectories
+            directories.extend(subdirectories)
+            self.directory_mtimes[directory] = mtime
+            scanned_at = self.scanned_at.get(directory)
+            self.scanned_at[directory] = time.time_ns()
+            if not report:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    continue
+                try:
+                    file_stat = entry.stat()
+                except OSError:
+                    continue
+                if scanned_at is None or max(file_stat.st_mtime_ns, file_stat.st_ctime_ns) >= scanned_at:
+                    self.changes.touch(directory, entry.name)
+
+
+def watch_posts(root_dir, ingest, settle=5.0, max_delay=60.0, poll_interval=2.0, force_polling=False):
+    """
+    Runs until interrupted, calling ingest(directory, names) for each directory
+    under root_dir whose files changed, once the changes have settled.
+    Uses watchdog (inotify and friends) when installed, otherwise polls every poll_interval seconds.
+    """
+    changes = PendingChanges(settle=settle, max_delay=max_delay)
+    observer = None
+    poller = None
+    if Observer is not None and not force_polling:
+        observer = Observer()
+        observer.schedule(EventHandler(changes), str(root_dir), recursive=True)
+        observer.start()
+        logging.info("Watching {0} for changes".format(root_dir))
+    else:
+        poller = DirectoryPoller(root_dir, changes)
+        logging.info("Polling {0} for changes every {1}s".format(root_dir, poll_interval))
+
+    try:
+        while True:
+            time.sleep(poll_interval if poller else min(poll_interval, settle))
+            if poller:
+                poller.walk()
+            for directory, names in changes.pop_ready():
+                try:
+                    ingest(directory, names)
+                except Exception as e:
+                    logging.exception("Error occurred ingesting changes in {0} - {1}".format(directory, e))
+    except KeyboardInterrupt:
+        logging.info("Stopping watch")
+    finally:
+        if observer:
+            observer.stop()
+            observer.join()